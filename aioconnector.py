@@ -0,0 +1,359 @@
+import asyncio
+import threading
+import time
+import traceback
+from collections import deque
+
+import binproto
+from connector import (
+    BINARY_PREFIX,
+    CONNECT_TIMEOUT,
+    RECONNECT_BASE_DELAY,
+    RECONNECT_MAX_DELAY,
+    SEND_BATCH_SIZE,
+    SEND_QUEUE_SIZE,
+    SUPPORTED_VERSIONS,
+    backoffDelay,
+    negotiatedVersion,
+    percentile,
+)
+
+# readuntil 能缓存的单条消息最大长度
+FRAME_LIMIT = 16 * 1024 * 1024
+
+
+async def readFrame(reader):
+    """
+    读取一条完整消息，返回的数据包含结尾的分隔符
+    和 connector.Framer 一样先按 0x04 分帧，格式错误的消息只丢弃到下一个分隔符，不影响后面的消息
+    """
+    frame = await reader.readuntil(b"\x04")
+    if not frame.startswith(BINARY_PREFIX):
+        return frame
+
+    # BF02 消息体是二进制，里面可能有 0x04，按长度前缀确定消息结束位置
+    headerEnd = frame.find(b"$")
+    if headerEnd < 0:
+        # 消息头格式错误，交给解码时报错
+        return frame
+    lenPos = headerEnd + 1
+    while len(frame) - lenPos < binproto.LENGTH_SIZE + 1:
+        frame += await reader.readuntil(b"\x04")
+
+    frameEnd = lenPos + binproto.LENGTH_SIZE + binproto.bodyLength(frame, lenPos)
+    if frameEnd - lenPos > FRAME_LIMIT:
+        raise ValueError("BF02 消息长度错误")
+    if frameEnd >= len(frame):
+        frame += await reader.readexactly(frameEnd + 1 - len(frame))
+    if frameEnd != len(frame) - 1 or frame[frameEnd] != 0x04:
+        # 长度和分隔符对不上，丢弃到下一个分隔符重新同步
+        if frame[-1] != 0x04:
+            await reader.readuntil(b"\x04")
+        raise ValueError("BF02 消息长度错误")
+    return frame
+
+
+class GatewaySender:
+    """
+    一个网关的发送队列，和 connector.SendWriter 一样有界、合并写入、统计延迟
+
+    任意线程调用 enqueue 放入队列，队列满时拒绝；事件循环里的 run 协程
+    把积压的多条消息合并成一次写入，再等待 drain，网关读得慢时写缓冲不会无限增长，
+    积压的消息留在队列里，队列满后新的消息被拒绝
+    """
+
+    def __init__(self, conn, maxQueue=SEND_QUEUE_SIZE, maxBatch=SEND_BATCH_SIZE):
+        self.conn = conn
+        self.maxQueue = maxQueue
+        self.maxBatch = maxBatch
+        # 只在事件循环线程里访问
+        self.pending = deque()
+        self.ready = asyncio.Event()
+
+        # 入队和写入在不同线程，队列长度加锁计数
+        self.lock = threading.Lock()
+        self.queued = 0
+
+        # 统计
+        self.enqueued = 0
+        self.sent = 0
+        self.rejected = 0  # 队列满被拒绝的消息数
+        self.dropped = 0  # 连接断开时还没发出的消息数
+        self.batches = 0
+        self.backpressure = False  # 最近一次入队是否因队列满失败
+        self.latencies = deque(maxlen=1000)  # 最近消息从入队到写入完成的耗时，秒
+        self.maxLatency = 0.0
+
+    def enqueue(self, msgBytes):
+        with self.lock:
+            if self.queued >= self.maxQueue:
+                self.rejected += 1
+                self.backpressure = True
+                return False
+            self.queued += 1
+            self.enqueued += 1
+            self.backpressure = False
+
+        self.conn.engine.loop.call_soon_threadsafe(self.push, time.perf_counter(), msgBytes)
+        return True
+
+    def push(self, enqueueTime, msgBytes):
+        self.pending.append((enqueueTime, msgBytes))
+        self.ready.set()
+
+    async def run(self):
+        pending = self.pending
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            while pending:
+                batch = [pending.popleft() for _ in range(min(self.maxBatch, len(pending)))]
+                try:
+                    await self.write(batch)
+                finally:
+                    with self.lock:
+                        self.queued -= len(batch)
+
+    async def write(self, batch):
+        writer = self.conn.writer
+        if writer is None:
+            self.dropped += len(batch)
+            return
+
+        try:
+            writer.write(b"".join(msgBytes for _, msgBytes in batch))
+            # 写缓冲超过高水位时等待网关读取
+            await writer.drain()
+        except OSError:
+            # 连接断开，由接收协程负责重连
+            print(traceback.format_exc())
+            self.dropped += len(batch)
+            return
+
+        now = time.perf_counter()
+        for enqueueTime, _ in batch:
+            latency = now - enqueueTime
+            self.latencies.append(latency)
+            if latency > self.maxLatency:
+                self.maxLatency = latency
+        self.sent += len(batch)
+        self.batches += 1
+
+
+class GatewayConnection:
+    """一个网关的连接协程，断开后按指数退避重连"""
+
+    def __init__(self, engine, host, port):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.writer = None
+        self.sender = GatewaySender(self)
+        # 发送消息使用的协议版本，每次连接后和网关协商
+        self.version = "BF01"
+
+        # 连接状态 : idle / connecting / connected / waiting
+        self.state = "idle"
+        self.attempts = 0
+        self.failures = 0
+        self.connects = 0
+        self.lastError = ""
+        self.connectedAt = None
+        self.disconnectedAt = None
+        self.lastReconnectTime = None
+
+    @property
+    def name(self):
+        return f"{self.host}:{self.port}"
+
+    async def run(self):
+        while True:
+            self.state = "connecting"
+            self.attempts += 1
+            try:
+                reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, limit=FRAME_LIMIT),
+                    CONNECT_TIMEOUT,
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self.lastError = repr(e)
+                self.failures += 1
+                await self.waitRetry()
+                continue
+
+            print(f"connection to gateway {self.name} ok")
+            now = time.monotonic()
+            self.connectedAt = now
+            self.connects += 1
+            if self.disconnectedAt is not None:
+                self.lastReconnectTime = now - self.disconnectedAt
+            self.failures = 0
+            self.state = "connected"
+
+            self.version = "BF01"
+            self.send("negotiate", {"versions": SUPPORTED_VERSIONS})
+
+            self.lastError = await self.receiveLoop(reader)
+
+            self.writer.close()
+            self.writer = None
+            self.disconnectedAt = time.monotonic()
+            self.failures += 1
+            await self.waitRetry()
+
+    async def receiveLoop(self, reader):
+        """接收并处理消息，直到连接断开，返回断开的原因"""
+        connector = self.engine.connector
+        while True:
+            try:
+                frame = await readFrame(reader)
+            except ValueError:
+                print(traceback.format_exc())
+                continue
+            except asyncio.IncompleteReadError:
+                print(f"gateway {self.name} closed connection")
+                return "server closed connection"
+            except asyncio.LimitOverrunError as e:
+                print(f"gateway {self.name} 消息超长")
+                return repr(e)
+            except OSError as e:
+                return repr(e)
+
+            connector.bytesReceived += len(frame)
+            # 一条消息处理出错只丢弃这条，不能让异常结束 gather，停掉所有网关
+            try:
+                self.handleFrame(frame)
+            except Exception:
+                print(traceback.format_exc())
+                connector.decodeFailures += 1
+
+    def handleFrame(self, frame):
+        decoded = self.engine.connector.handleFrame(memoryview(frame)[:-1])
+        if decoded is None:
+            return
+
+        # 记录设备所在的网关，控制命令发往对应网关
+        msgType, msgCode, msgBody = decoded
+        if msgType == "negotiate":
+            self.version = negotiatedVersion(msgBody)
+        elif msgType == "notify-to-frontend":
+            deviceSn = msgBody.get("device-sn")
+            if deviceSn:
+                self.engine.deviceSn_to_gateway[deviceSn] = self
+
+    async def waitRetry(self):
+        self.state = "waiting"
+        await asyncio.sleep(
+            backoffDelay(self.failures, RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY)
+        )
+
+    def send(self, msgType, msgBody, msgCode=None, isResend=0):
+        """连接建立后立即发送，只用于协商，其他消息经 self.sender 的队列发送"""
+        if self.writer is not None:
+            msgBytes = self.engine.connector.encodeMsg(
+                msgType, msgBody, self.version, msgCode, isResend
+            )
+            self.writer.write(msgBytes)
+
+
+class AsyncConnectorEngine:
+    """
+    多网关连接引擎
+
+    所有网关连接运行在同一个线程的 asyncio 事件循环里，每个网关一个协程，
+    收到的消息经 connector.handleFrame 解码后分发给 gstore.deviceSn_to_item
+    """
+
+    def __init__(self, connector, gateways):
+        self.connector = connector
+        self.connections = [GatewayConnection(self, host, port) for host, port in gateways]
+        self.deviceSn_to_gateway = {}
+        self.loop = None
+
+    def start(self):
+        thread = threading.Thread(target=self.threadRun, daemon=True)
+        thread.start()
+
+    def threadRun(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.main())
+        except:
+            print(traceback.format_exc())
+
+    async def main(self):
+        await asyncio.gather(
+            *[conn.run() for conn in self.connections],
+            *[conn.sender.run() for conn in self.connections],
+        )
+
+    def sendMsg(self, msgType: str, msgBody: dict, msgCode=None, isResend=0):
+        """
+        可以在任意线程调用，消息放入网关的发送队列后立即返回，实际写入在事件循环线程里执行
+        没有已连接的网关，或者发送队列都已满时返回 False
+        """
+        if self.loop is None:
+            return False
+
+        ok = False
+        # 每个网关协商的协议版本可能不同，分别编码
+        for conn in self.targets(msgBody):
+            msgBytes = self.connector.encodeMsg(msgType, msgBody, conn.version, msgCode, isResend)
+            ok = conn.sender.enqueue(msgBytes) or ok
+        return ok
+
+    def targets(self, msgBody):
+        """消息要发往的已连接网关"""
+        conn = self.deviceSn_to_gateway.get(msgBody.get("device-sn"))
+        if conn is not None and conn.writer is not None:
+            return [conn]
+
+        # 还不知道设备在哪个网关，或者所在网关已断开，发给所有已连接的网关
+        return [c for c in self.connections if c.writer is not None]
+
+    def sendSnapshot(self):
+        """汇总所有网关的发送队列，格式和 SendWriter.snapshot 一致"""
+        senders = [c.sender for c in self.connections]
+        latencies = sorted(x for sender in senders for x in sender.latencies)
+        return {
+            "queued": sum(sender.queued for sender in senders),
+            "maxQueue": sum(sender.maxQueue for sender in senders),
+            "enqueued": sum(sender.enqueued for sender in senders),
+            "sent": sum(sender.sent for sender in senders),
+            "rejected": sum(sender.rejected for sender in senders),
+            "dropped": sum(sender.dropped for sender in senders),
+            "batches": sum(sender.batches for sender in senders),
+            "backpressure": any(sender.backpressure for sender in senders),
+            "latencyP50": percentile(latencies, 50),
+            "latencyP95": percentile(latencies, 95),
+            "latencyMax": max((sender.maxLatency for sender in senders), default=0.0),
+        }
+
+    def snapshot(self):
+        """汇总所有网关的状态，格式和 ReconnectSupervisor.snapshot 一致"""
+        now = time.monotonic()
+        conns = self.connections
+        connected = [c for c in conns if c.state == "connected"]
+
+        if connected:
+            state = "connected"
+        elif any(c.state == "connecting" for c in conns):
+            state = "connecting"
+        else:
+            state = "waiting"
+
+        reconnectTimes = [c.lastReconnectTime for c in conns if c.lastReconnectTime is not None]
+        errors = [f"{c.name} {c.lastError}" for c in conns if c.lastError and c.state != "connected"]
+
+        return {
+            "state": state,
+            "attempts": sum(c.attempts for c in conns),
+            "connects": sum(c.connects for c in conns),
+            "failures": sum(c.failures for c in conns),
+            "lastError": "; ".join(errors),
+            "uptime": min((now - c.connectedAt for c in connected), default=0),
+            "lastReconnectTime": max(reconnectTimes, default=None),
+            "nextRetryIn": None,
+            "gateways": f"{len(connected)}/{len(conns)}",
+        }
@@ -0,0 +1,259 @@
+"""
+端到端吞吐和延迟基准测试
+
+在 offscreen Qt 平台下运行真实的 MWindow，加载生成的元件图，
+用 simulator.py 作为网关，按递增的速率推送设备消息，统计
+
+    每秒解码的消息数、每秒更新到item的消息数、
+    网关发出到重绘完成的延迟、界面事件循环延迟、内存峰值
+
+结果保存为 json，方便对比不同版本
+
+    python bench_e2e.py --devices 2000 --rates 1000 5000 20000 --output bench_e2e.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# resource 只有 Unix 上有，Windows 上用 psutil(可选)取内存峰值
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6 import QtCore, QtWidgets
+
+import connector as connectorModule
+from coalescer import coalescer
+from connector import connectionSnapshot, connector, percentile
+
+# 生成元件图时每种设备的 item 类型和图标
+DEVICE_TYPES = [
+    ("PictureItem_GasMeter", "gas-meter"),
+    ("PictureItem_TempMeter", "temp-meter"),
+    ("PictureItem_WindMeter", "wind-meter"),
+    ("PictureItem_WaterMeter", "water-meter"),
+    ("WaterTankItem", None),
+]
+
+
+def makeLayout(deviceCount, columns=40, spacing=100):
+    """生成 deviceCount 个设备的元件图，各种设备轮流排列成网格"""
+    layout = []
+    for i in range(deviceCount):
+        typeName, pic = DEVICE_TYPES[i % len(DEVICE_TYPES)]
+        pos = [float(i % columns * spacing), float(i // columns * spacing)]
+        deviceSn = f"bench-{i:06d}"
+        if pic is None:
+            layout.append(
+                {"type": typeName, "pos": pos, "props": {"zValue": "0.0", "设备编号": deviceSn}}
+            )
+            continue
+
+        layout.append(
+            {
+                "type": typeName,
+                "pos": pos,
+                "props": {
+                    "图标位置": "20,0",
+                    "图标宽度": "40",
+                    "文字内容": pic,
+                    "文字位置": "0,50",
+                    "文字宽度": "100",
+                    "zValue": "0.0",
+                    "设备编号": deviceSn,
+                },
+                "pic": pic,
+            }
+        )
+    return layout
+
+
+def peakRssMB():
+    """进程内存峰值(MB)，取不到时返回 None"""
+    if resource is None:
+        # Windows 上的峰值工作集
+        if psutil is None:
+            return None
+        return getattr(psutil.Process().memory_info(), "peak_wset", 0) / 1024 / 1024 or None
+
+    # Linux 上 ru_maxrss 单位是 KB，macOS 上是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1024 / 1024
+    return rss / 1024
+
+
+def runEventLoop(seconds):
+    loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec()
+
+
+class LoopLagProbe:
+    """用固定间隔的定时器测量界面事件循环的延迟"""
+
+    def __init__(self, interval=10):
+        self.interval = interval / 1000
+        self.lags = []
+        self.last = None
+        self.timer = QtCore.QTimer()
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(interval)
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.lags.append(max(0.0, now - self.last - self.interval))
+        self.last = now
+
+    def reset(self):
+        self.lags = []
+        self.last = None
+
+
+def waitConnected(timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if connectionSnapshot()["state"] == "connected":
+            return True
+        runEventLoop(0.05)
+    return False
+
+
+def msStats(values):
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 50) * 1000 if values else None,
+        "p95": percentile(values, 95) * 1000 if values else None,
+        "p99": percentile(values, 99) * 1000 if values else None,
+        "max": values[-1] * 1000 if values else None,
+    }
+
+
+def runStep(args, window, probe, layoutFile, rate):
+    sim = subprocess.Popen(
+        [
+            sys.executable,
+            "simulator.py",
+            "--port", str(args.port),
+            "--cfg", layoutFile,
+            "--rate", str(rate),
+            "--stats-len", str(args.stats_len),
+            "--timestamp",
+        ] + (["--binary"] if args.binary else []),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        if not waitConnected(15):
+            raise RuntimeError("连接模拟网关超时")
+
+        runEventLoop(args.warmup)
+
+        scheduler = window.renderScheduler
+        scheduler.wireToPaint.clear()
+        probe.reset()
+        decoded0, delivered0 = connector.framesDecoded, coalescer.delivered
+        batches0, batchTime0 = scheduler.batchCount, scheduler.totalBatchTime
+        t0 = time.perf_counter()
+
+        runEventLoop(args.duration)
+
+        cost = time.perf_counter() - t0
+        batches = scheduler.batchCount - batches0
+        return {
+            "rate": rate,
+            "decodedPerSec": (connector.framesDecoded - decoded0) / cost,
+            "appliedPerSec": (coalescer.delivered - delivered0) / cost,
+            "wireToPaintMs": msStats(scheduler.wireToPaint),
+            "loopLagMs": msStats(probe.lags),
+            "batchAvgMs": (scheduler.totalBatchTime - batchTime0) / batches if batches else None,
+            "batchMaxMs": scheduler.maxBatchTime,
+            "peakRssMB": peakRssMB(),
+        }
+    finally:
+        sim.terminate()
+        sim.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端吞吐和延迟基准测试")
+    parser.add_argument("--devices", type=int, default=1000, help="元件图中的设备数")
+    parser.add_argument("--rates", type=float, nargs="+", default=[500, 2000, 10000])
+    parser.add_argument("--duration", type=float, default=10, help="每个速率统计的秒数")
+    parser.add_argument("--warmup", type=float, default=2, help="每个速率统计前预热的秒数")
+    parser.add_argument("--stats-len", type=int, default=100)
+    parser.add_argument("--binary", action="store_true", help="使用 BF02 二进制消息体")
+    parser.add_argument("--port", type=int, default=47654)
+    parser.add_argument("--output", default="bench_e2e.json")
+    args = parser.parse_args()
+
+    # 图标按 ./images 相对路径加载
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    app = QtWidgets.QApplication([])
+
+    import main as mainModule
+
+    window = mainModule.window = mainModule.MWindow()
+    window.show()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf8") as f:
+        json.dump(makeLayout(args.devices), f, ensure_ascii=False)
+        layoutFile = f.name
+
+    t0 = time.perf_counter()
+    window.loadFile(layoutFile)
+    loadTime = time.perf_counter() - t0
+    print(f"layout: {args.devices} devices loaded in {loadTime:.2f}s")
+
+    connectorModule.SERVER_PORT = args.port
+    connectorModule.startCommunicationThread()
+    probe = LoopLagProbe()
+
+    steps = []
+    try:
+        for rate in args.rates:
+            step = runStep(args, window, probe, layoutFile, rate)
+            steps.append(step)
+            print(
+                f"rate {rate:>8,.0f}/s | decoded {step['decodedPerSec']:>8,.0f}/s"
+                f" | applied {step['appliedPerSec']:>8,.0f}/s"
+                f" | wire-to-paint p95 {step['wireToPaintMs']['p95'] or 0:>7.1f}ms"
+                f" | loop lag p95 {step['loopLagMs']['p95'] or 0:>6.1f}ms"
+                f" | rss {step['peakRssMB'] or 0:.0f}MB"
+            )
+    finally:
+        os.unlink(layoutFile)
+
+    result = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "devices": args.devices,
+        "binary": args.binary,
+        "layoutLoadSec": loadTime,
+        "steps": steps,
+    }
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"results saved to {args.output}")
+
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+分帧器基准测试
+
+模拟网关一次性突发推送大量 notify-to-frontend 消息，
+对比旧的 recvbuffer 拼接切片方式 和 Framer 的 帧率 与 每帧拷贝字节数
+
+    python bench_framer.py --frames 200000 --recv-size 65536
+"""
+
+import argparse
+import time
+
+from connector import BUFLEN, Framer, connector
+
+
+def makeStream(frameCount, version="BF01"):
+    frames = []
+    for i in range(frameCount):
+        body = {
+            "device-sn": f"aaaa{i % 10000:04d}",
+            "CO": 0.05,
+            "HCl": 0.01,
+            "SO2": 0.01,
+        }
+        frames.append(
+            connector.encodeMsg("notify-to-frontend", body, version, msgCode=str(i))
+        )
+    return b"".join(frames)
+
+
+class FakeSocket:
+    """按固定大小依次返回数据流的socket替身"""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def recv(self, size):
+        chunk = self.view[self.pos : self.pos + size]
+        self.pos += len(chunk)
+        return bytes(chunk)
+
+    def recv_into(self, buffer, size=0):
+        size = size or len(buffer)
+        chunk = self.view[self.pos : self.pos + size]
+        n = len(chunk)
+        buffer[:n] = chunk
+        self.pos += n
+        return n
+
+
+def runLegacy(data, recvSize):
+    # 旧版 connectionRun 的处理方式
+    sock = FakeSocket(data)
+    recvbuffer = b""
+    frameCount = 0
+    bytesCopied = 0
+    while True:
+        recved = sock.recv(recvSize)
+        if not recved:
+            break
+
+        bytesCopied += len(recvbuffer) + len(recved)
+        recvbuffer += recved
+
+        while True:
+            endPos = recvbuffer.find(b"\x04")
+            if endPos < 0:
+                break
+            msgBytes = recvbuffer[:endPos]
+            recvbuffer = recvbuffer[endPos + 1 :]
+            bytesCopied += len(msgBytes) + len(recvbuffer)
+            frameCount += 1
+
+    return frameCount, bytesCopied
+
+
+def runFramer(data, recvSize):
+    sock = FakeSocket(data)
+    framer = Framer(recvSize)
+    frameCount = 0
+    while framer.recvFrom(sock):
+        for _ in framer.frames():
+            frameCount += 1
+
+    return frameCount, framer.bytesCopied
+
+
+def runDecode(data, recvSize):
+    # 分帧加消息解码
+    sock = FakeSocket(data)
+    framer = Framer(recvSize)
+    frameCount = 0
+    while framer.recvFrom(sock):
+        for msgBytes in framer.frames():
+            connector.msg_decode(msgBytes)
+            frameCount += 1
+
+    return frameCount, framer.bytesCopied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--recv-size", type=int, nargs="+", default=[BUFLEN, 65536])
+    parser.add_argument(
+        "--version", nargs="+", default=["BF01", "BF02"], help="消息体协议版本"
+    )
+    args = parser.parse_args()
+
+    for version in args.version:
+        data = makeStream(args.frames, version)
+        print(f"\n{version} stream: {args.frames} frames, {len(data) / 1024 / 1024:.1f} MB")
+        print(f'{"method":<8}{"version":>8}{"recv":>8}{"frames/s":>14}{"copied/frame":>16}')
+
+        methods = [("framer", runFramer), ("decode", runDecode)]
+        # 旧的处理方式不认识二进制消息体
+        if version == "BF01":
+            methods.insert(0, ("legacy", runLegacy))
+
+        for recvSize in args.recv_size:
+            for name, func in methods:
+                t0 = time.perf_counter()
+                frameCount, bytesCopied = func(data, recvSize)
+                cost = time.perf_counter() - t0
+                assert frameCount == args.frames
+                print(
+                    f"{name:<8}{version:>8}{recvSize:>8}{frameCount / cost:>14,.0f}"
+                    f"{bytesCopied / frameCount:>16.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+风泵绘制基准测试
+
+在 offscreen Qt 平台下放置大量转动的 WindPumpItem，每一帧转动所有风扇后
+同步重绘视图，统计每秒能完成的帧数和 item paint 次数。
+--legacy 使用每次 paint 都新建画笔画刷、整体重画的旧绘制方式作对比
+
+--animator 不手动逐帧重绘，而是让所有风泵按最高转速由 pumpAnimator 驱动，
+在事件循环里运行 --seconds 秒，统计实际帧率和每秒消耗的 CPU 时间
+
+    python bench_paint.py --pumps 1000 --frames 200
+    python bench_paint.py --pumps 1000 --frames 200 --legacy
+    python bench_paint.py --pumps 5000 --animator --seconds 10
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6 import QtCore, QtGui, QtWidgets
+from PySide6.QtCore import QPoint
+
+
+class LegacyWindPumpItem:
+    """旧版 WindPumpItem.paint，用于对比"""
+
+    @staticmethod
+    def paint(self, painter, option, widget):
+        painter.setPen(QtGui.QPen(QtGui.QColor('#4c8bbe'), 1))
+        painter.setBrush(QtGui.QBrush(QtGui.QColor('#fff')))
+
+        if self.isSelected():
+            painter.drawRect(1, 1, 88, 98)
+
+        cx, cy = 40, 40
+        r = 35
+
+        painter.drawPolygon(
+            [
+                QPoint(cx-30,cy+20),
+                QPoint(cx-39,cy+55 ),
+                QPoint(cx+39,cy+55 ),
+                QPoint(cx+30,cy+20),
+            ]
+        )
+
+        painter.drawEllipse(QPoint(cx, cy), r, r)
+        painter.drawRect(cx, cy-r, r+10, r-10)
+        painter.setPen(QtGui.QPen(QtGui.QColor('white'), 2))
+        painter.drawLine(cx, cy-r+2, cx, cy-10)
+        painter.drawLine(cx, cy-10, cx+r-3, cy-10)
+
+        startAngle = int(self.startAngle)
+        painter.setPen(QtGui.QPen(QtGui.QColor('gray'), 1))
+        painter.drawPie(cx-25,cy-25, 50, 50, startAngle*16, 50*16)
+        painter.drawPie(cx-25,cy-25, 50, 50, (startAngle+120)*16, 50*16)
+        painter.drawPie(cx-25,cy-25, 50, 50, (startAngle+240)*16, 50*16)
+
+        btnY = cy + r + 4
+        width = 12
+        colorWhite = QtGui.QColor('white')
+        colorBlue  = QtGui.QColor('#6DCDDC')
+        painter.setPen(QtGui.QPen(QtGui.QColor('#4c8bbe'), 1))
+        for i, btnX in enumerate((10, 35, 60)):
+            if self.selectedBtn == i + 1:
+                painter.setBrush(QtGui.QBrush(colorBlue))
+            else:
+                painter.setBrush(QtGui.QBrush(colorWhite))
+            painter.drawRect(btnX, btnY, width, width)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="风泵绘制基准测试")
+    parser.add_argument("--pumps", type=int, default=1000, help="转动的风泵数")
+    parser.add_argument("--frames", type=int, default=200, help="统计的帧数")
+    parser.add_argument("--columns", type=int, default=40)
+    parser.add_argument("--width", type=int, default=1920, help="视图宽度")
+    parser.add_argument("--height", type=int, default=1080, help="视图高度")
+    parser.add_argument("--legacy", action="store_true", help="使用旧的绘制方式")
+    parser.add_argument("--animator", action="store_true", help="由共享动画时钟驱动")
+    parser.add_argument("--seconds", type=float, default=10, help="--animator 运行的秒数")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+
+    import main as mainModule
+
+    itemClass = mainModule.WindPumpItem
+    if args.legacy:
+        itemClass = type("LegacyPump", (mainModule.WindPumpItem,), {})
+        itemClass.paint = LegacyWindPumpItem.paint
+
+    scene = QtWidgets.QGraphicsScene()
+    paintCount = [0]
+    pumps = []
+    for i in range(args.pumps):
+        item = itemClass()
+        if args.legacy:
+            # 旧方式没有静态部分的子item
+            item.body.setVisible(False)
+        item.selectedBtn = i % 4 or None
+        item.setPos(i % args.columns * 45, i // args.columns * 50)
+        scene.addItem(item)
+        pumps.append(item)
+
+    # 统计实际调用的 paint 次数
+    origPaint = itemClass.paint
+
+    def countingPaint(self, painter, option, widget):
+        paintCount[0] += 1
+        origPaint(self, painter, option, widget)
+
+    itemClass.paint = countingPaint
+
+    view = QtWidgets.QGraphicsView(scene)
+    view.resize(args.width, args.height)
+    view.show()
+    app.processEvents()
+    # show 之后视口大小才确定，再缩放到显示全部风泵
+    view.fitInView(scene.itemsBoundingRect())
+    # 缩放不能低于 gstore.lodScale，否则只画简化色块，动画也会停止，测不到正常绘制
+    lodScale = mainModule.gstore.lodScale
+    if view.transform().m11() < lodScale:
+        view.setTransform(QtGui.QTransform.fromScale(lodScale, lodScale))
+    app.processEvents()
+
+    # 预热，建立 item 缓存
+    for _ in range(5):
+        for item in pumps:
+            item.rotate(20)
+        view.viewport().repaint()
+
+    if args.animator:
+        runAnimator(args, app, mainModule, pumps, paintCount)
+        return
+
+    paintCount[0] = 0
+    t0 = time.perf_counter()
+    for _ in range(args.frames):
+        for item in pumps:
+            item.rotate(20)
+        view.viewport().repaint()
+    cost = time.perf_counter() - t0
+
+    mode = "legacy" if args.legacy else "cached"
+    print(
+        f"{mode}: {args.pumps} pumps, {args.frames} frames in {cost:.2f}s"
+        f" | {args.frames / cost:,.1f} frames/s"
+        f" | {paintCount[0] / cost:,.0f} paints/s"
+        f" | {cost / args.frames * 1000:.2f} ms/frame"
+    )
+
+
+def runAnimator(args, app, mainModule, pumps, paintCount):
+    animator = mainModule.pumpAnimator
+    speed = max(mainModule.WindPumpItem.BTN_SPEEDS.values())
+    for item in pumps:
+        item.selectedBtn = 3
+        animator.setSpeed(item, speed)
+
+    paintCount[0] = 0
+    frames0 = animator.frames
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+
+    loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(args.seconds * 1000), loop.quit)
+    loop.exec()
+
+    cost = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    animator.clear()
+    # 没有风泵在转动时测到的帧率没有意义
+    assert animator.lastVisible > 0, "没有可见的风泵，检查视图缩放是否低于 gstore.lodScale"
+
+    print(
+        f"animator: {args.pumps} pumps, {mainModule.gstore.pumpAnimationFps} fps cap"
+        f" | {(animator.frames - frames0) / cost:,.1f} frames/s"
+        f" | visible {animator.lastVisible}"
+        f" | {paintCount[0] / cost:,.0f} paints/s"
+        f" | cpu {cpu / cost * 100:.0f}%"
+    )
+
+
+if __name__ == "__main__":
+    main()
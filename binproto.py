@@ -0,0 +1,173 @@
+"""
+BF02 二进制消息体编解码
+
+消息格式 : BF02|消息类型|是否重发|消息编号[|设备编号]$ + 消息体 + 0x04
+消息体   : u32 长度 + 若干字段，全部小端序
+
+每个字段 : u8 字段编号 [字段编号为0时，跟 u8 名称长度 + 名称] + u8 类型 + 值
+类型     : d - f64
+           q - i64
+           s - u16 长度 + utf8 字符串
+           D - u32 个数 + f64 数组，元素全是 float
+           Q - u32 个数 + i64 数组，元素全是 i64 范围内的 int
+           j - u32 长度 + json 文本，其他无法直接表示的值(包括 int、float 混合的数组)
+
+编码结果解码后和原消息体完全相同，类型不变。
+字段名超过 255 字节无法编码，encodeBody 抛出 ValueError，调用方改用 json 消息体。
+
+常用字段用编号代替名称，读数用定长数值，统计数组直接是 f64 数组，
+比 json 文本小，解码也不需要逐字符解析。
+"""
+
+import json
+import struct
+
+VERSION = "BF02"
+
+# 字段编号，只能追加，不能修改已有编号
+FIELD_IDS = {
+    "device-sn": 1,
+    "CO": 2,
+    "SO2": 3,
+    "HCl": 4,
+    "temperature": 5,
+    "humidity": 6,
+    "flow-rate": 7,
+    "water-pressure": 8,
+    "water-amount": 9,
+    "operation": 10,
+    "fan-speed": 11,
+    "ts": 12,
+    "coal-1": 16,
+    "coal-2": 17,
+    "w-used": 18,
+    "e-used": 19,
+}
+FIELD_NAMES = {fieldId: name for name, fieldId in FIELD_IDS.items()}
+
+_u8 = struct.Struct("<B")
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+_f64 = struct.Struct("<d")
+_i64 = struct.Struct("<q")
+
+LENGTH_SIZE = _u32.size
+
+
+def _isFloatList(value):
+    return isinstance(value, list) and all(type(v) is float for v in value)
+
+
+def _isIntList(value):
+    return isinstance(value, list) and all(
+        type(v) is int and -(2**63) <= v < 2**63 for v in value
+    )
+
+
+def encodeBody(msgBody: dict) -> bytes:
+    """把消息体编码为带长度前缀的二进制，device-sn 固定放在第一个字段"""
+    out = []
+
+    items = list(msgBody.items())
+    items.sort(key=lambda kv: kv[0] != "device-sn")
+
+    for name, value in items:
+        fieldId = FIELD_IDS.get(name, 0)
+        out.append(_u8.pack(fieldId))
+        if fieldId == 0:
+            nameBytes = name.encode()
+            if len(nameBytes) > 0xFF:
+                raise ValueError(f"字段名超长 {name[:20]}...")
+            out.append(_u8.pack(len(nameBytes)) + nameBytes)
+
+        valueType = type(value)
+        valueBytes = value.encode() if valueType is str else None
+        if valueType is float:
+            out.append(b"d" + _f64.pack(value))
+        elif valueType is int and -(2**63) <= value < 2**63:
+            out.append(b"q" + _i64.pack(value))
+        elif valueBytes is not None and len(valueBytes) <= 0xFFFF:
+            out.append(b"s" + _u16.pack(len(valueBytes)) + valueBytes)
+        elif _isFloatList(value):
+            out.append(
+                b"D" + _u32.pack(len(value)) + struct.pack(f"<{len(value)}d", *value)
+            )
+        elif _isIntList(value):
+            out.append(
+                b"Q" + _u32.pack(len(value)) + struct.pack(f"<{len(value)}q", *value)
+            )
+        else:
+            # 超过 u16 长度的字符串也在这里
+            valueBytes = json.dumps(value).encode()
+            out.append(b"j" + _u32.pack(len(valueBytes)) + valueBytes)
+
+    body = b"".join(out)
+    return _u32.pack(len(body)) + body
+
+
+def bodyLength(data, pos=0):
+    """读取长度前缀，返回消息体(不含长度前缀)的字节数"""
+    return _u32.unpack_from(data, pos)[0]
+
+
+def decodeBody(data) -> dict:
+    """解码 encodeBody 的结果，data 包含长度前缀"""
+    end = LENGTH_SIZE + bodyLength(data)
+    if len(data) < end:
+        raise Exception("二进制消息体长度不足")
+
+    msgBody = {}
+    pos = LENGTH_SIZE
+    while pos < end:
+        fieldId = data[pos]
+        pos += 1
+        if fieldId == 0:
+            nameLen = data[pos]
+            name = bytes(data[pos + 1 : pos + 1 + nameLen]).decode()
+            pos += 1 + nameLen
+        else:
+            name = FIELD_NAMES.get(fieldId)
+            if name is None:
+                raise Exception(f"未知字段编号 {fieldId}")
+
+        valueType = data[pos]
+        pos += 1
+        if valueType == 0x64:  # d
+            value = _f64.unpack_from(data, pos)[0]
+            pos += 8
+        elif valueType == 0x71:  # q
+            value = _i64.unpack_from(data, pos)[0]
+            pos += 8
+        elif valueType == 0x73:  # s
+            size = _u16.unpack_from(data, pos)[0]
+            value = bytes(data[pos + 2 : pos + 2 + size]).decode()
+            pos += 2 + size
+        elif valueType == 0x44:  # D
+            count = _u32.unpack_from(data, pos)[0]
+            value = list(struct.unpack_from(f"<{count}d", data, pos + 4))
+            pos += 4 + count * 8
+        elif valueType == 0x51:  # Q
+            count = _u32.unpack_from(data, pos)[0]
+            value = list(struct.unpack_from(f"<{count}q", data, pos + 4))
+            pos += 4 + count * 8
+        elif valueType == 0x6A:  # j
+            size = _u32.unpack_from(data, pos)[0]
+            value = json.loads(bytes(data[pos + 4 : pos + 4 + size]))
+            pos += 4 + size
+        else:
+            raise Exception(f"未知字段类型 {valueType}")
+
+        msgBody[name] = value
+
+    return msgBody
+
+
+def peekDeviceSn(data):
+    """不解码整个消息体，读取第一个字段中的 device-sn，没有则返回 None"""
+    if len(data) < LENGTH_SIZE + 4:
+        return None
+    if data[LENGTH_SIZE] != FIELD_IDS["device-sn"] or data[LENGTH_SIZE + 1] != 0x73:
+        return None
+    size = _u16.unpack_from(data, LENGTH_SIZE + 2)[0]
+    start = LENGTH_SIZE + 4
+    return bytes(data[start : start + size]).decode()
@@ -0,0 +1,130 @@
+"""
+网关消息抓包和回放
+
+抓包文件格式 : 文件头 MAGIC，之后每条消息一条记录
+    f64 接收时间(unix 秒) + u32 消息长度 + 消息内容(不含结尾的 0x04)
+全部小端序
+
+回放时把消息按原来的时间间隔(或按倍速、或尽快)交给 connector.handleFrame，
+和实际接收走同样的解码、分发流程。
+"""
+
+import struct
+import threading
+import time
+import traceback
+
+MAGIC = b"BSCAP1\n"
+RECORD = struct.Struct("<dI")
+
+
+class CaptureWriter:
+    """接收线程调用 write 记录消息，写入带大缓冲区，不会每条消息都写磁盘"""
+
+    def __init__(self, path, bufferSize=1024 * 1024):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "wb", buffering=bufferSize)
+        self.file.write(MAGIC)
+        self.frames = 0
+        self.bytes = 0
+
+    def write(self, frame, ts=None):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(ts or time.time(), len(frame)))
+            self.file.write(frame)
+            self.frames += 1
+            self.bytes += len(frame)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def readCapture(path):
+    """依次返回抓包文件中的 (接收时间, 消息内容)"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} 不是抓包文件")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            ts, size = RECORD.unpack(head)
+            frame = f.read(size)
+            if len(frame) < size:
+                # 抓包时程序异常退出，最后一条不完整
+                return
+            yield ts, frame
+
+
+class Replayer:
+    """
+    回放抓包文件
+
+    speed 为回放倍速，1 按原来的时间间隔，0 不等待、尽快回放
+    """
+
+    def __init__(self, connector, path, speed=1.0, loops=1):
+        self.connector = connector
+        self.path = path
+        self.speed = speed
+        self.loops = loops
+
+        # 统计
+        self.frames = 0
+        self.bytes = 0
+        self.lag = 0.0  # 回放落后于应有进度的秒数
+        self.startTime = None
+        self.endTime = None
+
+    def start(self):
+        thread = threading.Thread(target=self.threadRun, daemon=True)
+        thread.start()
+        return thread
+
+    def threadRun(self):
+        try:
+            self.run()
+        except:
+            print(traceback.format_exc())
+
+    def run(self):
+        handleFrame = self.connector.handleFrame
+        speed = self.speed
+        self.startTime = time.perf_counter()
+
+        for _ in range(self.loops):
+            first = None
+            loopStart = time.perf_counter()
+
+            for ts, frame in readCapture(self.path):
+                if speed > 0:
+                    if first is None:
+                        first = ts
+                    delay = (ts - first) / speed - (time.perf_counter() - loopStart)
+                    self.lag = max(0.0, -delay)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                handleFrame(frame)
+                self.frames += 1
+                self.bytes += len(frame)
+
+        self.endTime = time.perf_counter()
+
+    def snapshot(self):
+        end = self.endTime or time.perf_counter()
+        cost = end - self.startTime if self.startTime else 0
+        return {
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "seconds": cost,
+            "framesPerSec": self.frames / cost if cost else 0,
+            "lag": self.lag,
+            "done": self.endTime is not None,
+        }
@@ -0,0 +1,71 @@
+import threading
+
+
+class NotifyCoalescer:
+    """
+    设备通知合并
+
+    接收线程把每条 notify-to-frontend 消息按 device-sn 放进来，
+    同一设备只保留最新一条，界面线程定时一次性取走。
+    这样传感器上报再频繁，每个设备每次刷新也只处理一次。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+        # 统计
+        self.received = 0  # 放入的消息总数
+        self.merged = 0  # 被同一设备更新的消息覆盖掉的旧消息数
+        self.dropped = 0  # 取走时设备已不存在而丢弃的消息数
+        self.delivered = 0  # 交给界面处理的消息数
+        self.drains = 0  # 取走的次数
+
+    def put(self, deviceSn, msgBody):
+        with self.lock:
+            if deviceSn in self.pending:
+                self.merged += 1
+            self.pending[deviceSn] = msgBody
+            self.received += 1
+
+    def putDelta(self, deviceSn, msgBody):
+        """
+        增量消息，数组字段只包含新的点，不能直接覆盖，和待处理的消息按顺序拼接。
+        待处理的是完整消息时拼接后仍是完整消息，否则标记为 delta
+        """
+        with self.lock:
+            pending = self.pending.get(deviceSn)
+            if pending is None:
+                pending = self.pending[deviceSn] = {"device-sn": deviceSn, "delta": True}
+            else:
+                self.merged += 1
+
+            for name, values in msgBody.items():
+                if isinstance(values, list):
+                    old = pending.get(name)
+                    pending[name] = old + values if old else values
+            self.received += 1
+
+    def drain(self):
+        """取走所有待处理的消息，返回 {device-sn : 最新消息}"""
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.drains += 1
+        return pending
+
+    def pendingCount(self):
+        return len(self.pending)
+
+    def snapshot(self):
+        return {
+            "received": self.received,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "delivered": self.delivered,
+            "drains": self.drains,
+            "pending": len(self.pending),
+        }
+
+
+coalescer = NotifyCoalescer()
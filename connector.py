@@ -1,139 +1,952 @@
-import threading, json, time
+import threading, json, time, random
+import re
 import socket
+import queue
+from collections import deque
 import traceback
 
 from share import gstore
+from coalescer import coalescer
+from telemetry import telemetry
+from historystore import historyStore
+import binproto
+import metrics
 
 IP = "127.0.0.1"
 SERVER_PORT = 47554
+# 网关列表，多于一个时使用 asyncio 引擎，在一个线程里同时连接所有网关
+GATEWAYS = [(IP, SERVER_PORT)]
 BUFLEN = 1024
+# 每次 recv_into 的最大字节数，突发流量大时可以调大
+RECV_SIZE = 64 * 1024
+# BF02 消息体是二进制，分帧时要按长度处理
+BINARY_PREFIX = b"BF02|"
+# 本客户端支持的协议版本，连接后和网关协商，按优先顺序排列
+SUPPORTED_VERSIONS = [binproto.VERSION, "BF01"]
+CONNECT_TIMEOUT = 5
+# 重连等待时间，单位秒，连续失败时按指数增长，最长 RECONNECT_MAX_DELAY
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# 发送队列最多缓存的消息数，满了以后 sendMsg 返回 False
+SEND_QUEUE_SIZE = 256
+# 发送线程一次最多合并写入的消息数
+SEND_BATCH_SIZE = 32
+# 网关确认控制命令的消息类型，消息头里的消息编号和原命令相同
+CONTROL_ACK_TYPE = "device_control_ack"
+# stats 增量消息类型，数组字段只包含新增的点
+STATS_DELTA_TYPE = "stats-delta"
+# 控制命令多少秒没有确认就重发，重发 CONTROL_MAX_RETRIES 次仍无确认算超时
+CONTROL_TIMEOUT = 2.0
+CONTROL_MAX_RETRIES = 2
+
+
+class Framer:
+    """
+    增量分帧器，把 0x04 结尾的消息从字节流中切分出来
+
+    接收缓冲是一块可复用的 bytearray，socket 直接 recv_into 到空闲区，
+    每次接收只扫描新到的数据，切出的消息是缓冲区的 memoryview，不产生拷贝。
+    只有残留的半条消息需要挪到缓冲区开头时，才会拷贝数据。
+    """
+
+    def __init__(self, recvSize=BUFLEN, delimiter=b"\x04"):
+        self.recvSize = recvSize
+        self.delimiter = delimiter
+        self.buf = bytearray(recvSize * 4)
+        self.view = memoryview(self.buf)
+        self.start = 0  # 未处理数据的起始位置
+        self.end = 0  # 已接收数据的结束位置
+        self.scanPos = 0  # 下次查找分隔符的位置，已经扫描过的数据不再扫描
+
+        # 统计
+        self.bytesReceived = 0
+        self.bytesCopied = 0
+        self.frameCount = 0
+
+    def reset(self):
+        self.start = self.end = self.scanPos = 0
+
+    def _reserve(self, size):
+        # 保证缓冲区尾部至少有 size 字节空闲
+        if self.end + size <= len(self.buf):
+            return
+
+        remain = self.end - self.start
+        if remain + size <= len(self.buf):
+            # 把残留的半条消息挪到开头
+            self.buf[0:remain] = self.buf[self.start : self.end]
+        else:
+            # 单条消息超过缓冲区，扩容
+            newBuf = bytearray(max(len(self.buf) * 2, remain + size))
+            newBuf[0:remain] = self.buf[self.start : self.end]
+            self.buf = newBuf
+            self.view = memoryview(newBuf)
+
+        self.bytesCopied += remain
+        self.scanPos -= self.start
+        self.start, self.end = 0, remain
+
+    def recvFrom(self, sock):
+        """从socket接收一次数据，返回接收的字节数，0 表示对方关闭了连接"""
+        self._reserve(self.recvSize)
+        n = sock.recv_into(self.view[self.end : self.end + self.recvSize])
+        self.end += n
+        self.bytesReceived += n
+        return n
+
+    def feed(self, data):
+        """直接写入一段数据，用于非socket数据源"""
+        size = len(data)
+        self._reserve(size)
+        self.buf[self.end : self.end + size] = data
+        self.end += size
+        self.bytesReceived += size
+
+    def _binaryFrameEnd(self):
+        """
+        BF02 消息体是带长度前缀的二进制，里面可能出现 0x04，按长度确定消息结束位置
+        返回分隔符所在位置，数据还不完整时返回 -1
+        """
+        buf = self.buf
+        headerEnd = buf.find(b"$", self.start, self.end)
+        if headerEnd < 0:
+            return -1
+
+        lenPos = headerEnd + 1
+        if self.end - lenPos < binproto.LENGTH_SIZE:
+            return -1
+
+        frameEnd = lenPos + binproto.LENGTH_SIZE + binproto.bodyLength(buf, lenPos)
+        if frameEnd >= self.end:
+            return -1
+
+        return frameEnd
+
+    def frames(self):
+        """
+        依次返回当前缓冲区里的完整消息(不含分隔符)
+        返回的是 memoryview，只在下次接收数据前有效
+        """
+        buf, view, delimiter = self.buf, self.view, self.delimiter
+        while True:
+            if buf.startswith(BINARY_PREFIX, self.start, self.end):
+                endPos = self._binaryFrameEnd()
+                # 还没有接收到完整的消息
+                if endPos < 0:
+                    break
+
+                # 长度和分隔符对不上，按分隔符重新同步
+                if buf[endPos] != delimiter[0]:
+                    self.scanPos = max(self.scanPos, endPos)
+                    endPos = buf.find(delimiter, self.scanPos, self.end)
+            else:
+                endPos = buf.find(delimiter, self.scanPos, self.end)
+
+            # 还没有接收到完整的消息
+            if endPos < 0:
+                self.scanPos = self.end
+                break
+
+            frame = view[self.start : endPos]
+            self.start = self.scanPos = endPos + 1
+            self.frameCount += 1
+            yield frame
+
+        # 数据全部处理完，下次从头写入
+        if self.start == self.end:
+            self.reset()
+
+
+def percentile(sortedValues, p):
+    if not sortedValues:
+        return None
+    index = min(len(sortedValues) - 1, int(len(sortedValues) * p / 100))
+    return sortedValues[index]
+
+
+class SendWriter:
+    """
+    发送线程
+
+    界面线程调用 sendMsg 时只是把消息放进有界队列，由发送线程写入socket，
+    网关响应慢时不会卡住界面。队列里积压的多条消息合并成一次写入。
+    队列满时拒绝新消息，由调用方提示用户。
+    """
+
+    def __init__(self, maxQueue=SEND_QUEUE_SIZE, maxBatch=SEND_BATCH_SIZE):
+        self.queue = queue.Queue(maxQueue)
+        self.maxQueue = maxQueue
+        self.maxBatch = maxBatch
+
+        self.sockLock = threading.Lock()
+        self.sock = None
+        self.thread = None
+
+        # 统计
+        self.enqueued = 0
+        self.sent = 0
+        self.rejected = 0  # 队列满被拒绝的消息数
+        self.dropped = 0  # 连接断开时还没发出的消息数
+        self.batches = 0
+        self.backpressure = False  # 最近一次入队是否因队列满失败
+        self.latencies = deque(maxlen=1000)  # 最近消息从入队到写入socket的耗时，秒
+        self.maxLatency = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def attach(self, sock):
+        with self.sockLock:
+            self.sock = sock
+
+    def detach(self):
+        with self.sockLock:
+            self.sock = None
+
+    def enqueue(self, msgBytes):
+        try:
+            self.queue.put_nowait((time.perf_counter(), msgBytes))
+        except queue.Full:
+            self.rejected += 1
+            self.backpressure = True
+            return False
+
+        self.enqueued += 1
+        self.backpressure = False
+        return True
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.maxBatch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            with self.sockLock:
+                sock = self.sock
+
+            if sock is None:
+                self.dropped += len(batch)
+                continue
+
+            try:
+                sock.sendall(b"".join(msgBytes for _, msgBytes in batch))
+            except OSError:
+                # 连接断开，由接收线程负责重连
+                print(traceback.format_exc())
+                self.dropped += len(batch)
+                continue
+
+            now = time.perf_counter()
+            for enqueueTime, _ in batch:
+                latency = now - enqueueTime
+                self.latencies.append(latency)
+                if latency > self.maxLatency:
+                    self.maxLatency = latency
+            self.sent += len(batch)
+            self.batches += 1
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queued": self.queue.qsize(),
+            "maxQueue": self.maxQueue,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "backpressure": self.backpressure,
+            "latencyP50": percentile(latencies, 50),
+            "latencyP95": percentile(latencies, 95),
+            "latencyMax": self.maxLatency,
+        }
+
+
+class CommandTracker:
+    """
+    控制命令往返延迟统计
+
+    记录发出的 device_control 命令，用消息编号匹配网关的确认消息，
+    按 operation 分别统计从发出到确认的延迟。超时没有确认的命令重发，
+    重发次数用完后算超时。
+    """
+
+    def __init__(
+        self, timeout=CONTROL_TIMEOUT, maxRetries=CONTROL_MAX_RETRIES, historySize=1000
+    ):
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        self.historySize = historySize
+
+        self.lock = threading.Lock()
+        self.pending = {}  # 消息编号 -> 待确认命令
+        self.latencies = {}  # operation -> 最近的延迟，秒
+        self.latencySums = {}  # operation -> 累计延迟，秒
+        self.latencyCounts = {}  # operation -> 累计确认数
+        self.thread = None
+
+        # 统计
+        self.acked = 0
+        self.resends = 0
+        self.timeouts = {}  # operation -> 超时次数
+        self.unknownAcks = 0  # 找不到对应命令的确认，比如超时以后才到达
+
+    def start(self, resend):
+        """resend(msgType, msgBody, msgCode) 用于重发，返回是否发出"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, args=(resend,), daemon=True)
+            self.thread.start()
+
+    def track(self, msgCode, msgType, msgBody):
+        now = time.monotonic()
+        with self.lock:
+            self.pending[msgCode] = {
+                "msgType": msgType,
+                "msgBody": msgBody,
+                "operation": msgBody.get("operation", msgType),
+                "firstSentAt": now,
+                "sentAt": now,
+                "retries": 0,
+            }
+
+    def untrack(self, msgCode):
+        """命令没有发出，不再等待确认"""
+        with self.lock:
+            self.pending.pop(msgCode, None)
+
+    def ack(self, msgCode):
+        """收到确认，返回命令从第一次发出到确认的延迟，找不到对应命令返回 None"""
+        with self.lock:
+            cmd = self.pending.pop(msgCode, None)
+            if cmd is None:
+                self.unknownAcks += 1
+                return None
+
+            latency = time.monotonic() - cmd["firstSentAt"]
+            history = self.latencies.get(cmd["operation"])
+            if history is None:
+                history = self.latencies[cmd["operation"]] = deque(maxlen=self.historySize)
+            history.append(latency)
+            op = cmd["operation"]
+            self.latencySums[op] = self.latencySums.get(op, 0.0) + latency
+            self.latencyCounts[op] = self.latencyCounts.get(op, 0) + 1
+            self.acked += 1
+        return latency
+
+    def expire(self):
+        """返回需要重发的命令，重发次数用完的从待确认中删除"""
+        now = time.monotonic()
+        resendList = []
+        with self.lock:
+            for msgCode, cmd in list(self.pending.items()):
+                if now - cmd["sentAt"] < self.timeout:
+                    continue
+
+                if cmd["retries"] >= self.maxRetries:
+                    del self.pending[msgCode]
+                    op = cmd["operation"]
+                    self.timeouts[op] = self.timeouts.get(op, 0) + 1
+                    continue
+
+                cmd["retries"] += 1
+                cmd["sentAt"] = now
+                self.resends += 1
+                resendList.append((msgCode, cmd))
+        return resendList
+
+    def run(self, resend):
+        while True:
+            time.sleep(min(0.2, self.timeout / 4))
+            for msgCode, cmd in self.expire():
+                resend(cmd["msgType"], cmd["msgBody"], msgCode)
+
+    def snapshot(self):
+        with self.lock:
+            operations = {}
+            for op in set(self.latencies) | set(self.timeouts):
+                latencies = sorted(self.latencies.get(op, ()))
+                operations[op] = {
+                    "count": len(latencies),
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "sum": self.latencySums.get(op, 0.0),
+                    "total": self.latencyCounts.get(op, 0),
+                    "timeouts": self.timeouts.get(op, 0),
+                }
+
+            return {
+                "outstanding": len(self.pending),
+                "acked": self.acked,
+                "resends": self.resends,
+                "timeouts": sum(self.timeouts.values()),
+                "unknownAcks": self.unknownAcks,
+                "operations": operations,
+            }
+
+
+def backoffDelay(failures, baseDelay, maxDelay, factor=2.0, jitter=0.5):
+    """第 failures 次连续失败后的重连等待时间，随机缩短最多 jitter 比例"""
+    delay = min(maxDelay, baseDelay * factor ** (failures - 1))
+    return delay * random.uniform(1 - jitter, 1)
+
+
+DEVICE_SN_KEY = b'"device-sn"'
+# json 字符串和括号，跳过数字、true 等其它内容
+JSON_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+# 键后面的冒号
+JSON_COLON = re.compile(rb"\s*:\s*")
+
+
+def peekDeviceSn(msgBodyBytes: bytes):
+    """
+    不解码json，直接在消息体里找出最外层的 device-sn 的值，
+    嵌套对象里的 device-sn(比如网关信息)不算。
+    找不到或者格式不是简单字符串时返回 None，由调用方完整解码
+    """
+    depth = 0
+    for token in JSON_TOKEN.finditer(msgBodyBytes):
+        text = token.group()
+        if text == b"{" or text == b"[":
+            depth += 1
+        elif text == b"}" or text == b"]":
+            depth -= 1
+        elif depth == 1 and text == DEVICE_SN_KEY:
+            colon = JSON_COLON.match(msgBodyBytes, token.end())
+            # 没有冒号，是值不是键
+            if colon is None:
+                continue
+
+            value = JSON_TOKEN.match(msgBodyBytes, colon.end())
+            if value is None or not value.group().startswith(b'"'):
+                return None
+            value = value.group()[1:-1]
+            # 有转义字符的，交给json解码
+            if b"\\" in value:
+                return None
+            return value.decode("ascii", errors="replace")
+
+    return None
+
+
+def isStatsDelta(msgBody):
+    """stats-delta 消息体应为对象，除 device-sn 外每个字段都是数字数组"""
+    if not isinstance(msgBody, dict):
+        return False
+    for name, values in msgBody.items():
+        if name == "device-sn":
+            continue
+        if not isinstance(values, list) or not all(type(v) in (int, float) for v in values):
+            return False
+    return True
+
+
+def negotiatedVersion(msgBody):
+    """网关回复的 negotiate 消息里选定的版本，不支持的版本按 BF01 处理"""
+    version = msgBody.get("version")
+    if version in SUPPORTED_VERSIONS:
+        print(f"protocol version : {version}")
+        return version
+    return "BF01"
 
 
 class Connector:
     def __init__(self):
         self.dataSocket = None
         self.connected = False
+        self.bytesReceived = 0
+        self.framesDecoded = 0  # 解码的消息数
+        self.framesSkipped = 0  # 不在界面上的设备的消息数，多数不做json解码
+        self.decodeFailures = 0
+        self.missingDeviceSn = 0  # 缺少 device-sn 字段的消息数
+        self.deviceMsgCounts = {}  # device-sn -> 分发给界面的消息数
+        # 多网关时由 asyncio 引擎负责收发，见 aioconnector.py
+        self.engine = None
+        # 发送消息使用的协议版本，每次连接后和网关协商
+        self.protocolVersion = "BF01"
+
+        self.msgCodeLock = threading.Lock()
+        self.lastMsgCode = 0
+
+        self.writer = SendWriter()
+        self.tracker = CommandTracker()
+        # 抓包时为 capture.CaptureWriter，记录收到的每条原始消息
+        self.capture = None
+
+    def nextMsgCode(self):
+        # 微秒时间戳，同一微秒内的多条消息依次加1，保证不重复
+        with self.msgCodeLock:
+            msgCode = max(self.lastMsgCode + 1, time.time_ns() // 1000)
+            self.lastMsgCode = msgCode
+        return str(msgCode)
+
+    def encodeMsg(
+        self,
+        msgType: str,
+        msgBody: dict,
+        version="BF01",
+        msgCode=None,
+        isResend=0,
+        headerSn=None,
+    ):
+        if msgCode is None:
+            msgCode = self.nextMsgCode()
 
-    def sendMsg(self, msgType: str, msgBody: dict):
-        if not self.connected:
-            return
+        if version == binproto.VERSION:
+            try:
+                msgBodyBytes = binproto.encodeBody(msgBody)
+            except ValueError as e:
+                # 二进制格式表示不了的消息(比如字段名超长)，改用 json 消息体
+                print(f"{e}，改用 json 消息体")
+                version = "BF01"
+
+        # headerSn 是消息头里可选的设备编号字段
+        if headerSn:
+            msgHeaderStr = f"{version}|{msgType}|{isResend}|{msgCode}|{headerSn}$"
+        else:
+            msgHeaderStr = f"{version}|{msgType}|{isResend}|{msgCode}$"
 
-        msgCode = f"{time.time()}"
+        if version == binproto.VERSION:
+            return msgHeaderStr.encode() + msgBodyBytes + b"\x04"
 
-        msgHeaderStr = f"BF01|{msgType}|0|{msgCode}$"
         msgBodyStr = json.dumps(msgBody)
+        return (msgHeaderStr + msgBodyStr).encode() + b"\x04"
 
-        msgBytes = (msgHeaderStr + msgBodyStr).encode() + b"\x04"
-        # print(msgBytes)
-        self.dataSocket.sendall(msgBytes)
+    def sendMsg(self, msgType: str, msgBody: dict):
+        """
+        消息放入发送队列后立即返回，不等待写入socket
+        未连接或者发送队列已满时返回 False
+        """
+        msgCode = self.nextMsgCode()
+
+        # 控制命令等待网关确认，统计往返延迟。
+        # 放入发送队列前就要记录，确认可能在 enqueue 返回之前就被接收线程处理
+        tracked = msgType == "device_control"
+        if tracked:
+            self.tracker.track(msgCode, msgType, msgBody)
+            self.tracker.start(self.resendMsg)
+
+        if self.engine:
+            ok = self.engine.sendMsg(msgType, msgBody, msgCode)
+        elif self.connected:
+            msgBytes = self.encodeMsg(msgType, msgBody, self.protocolVersion, msgCode)
+            # print(msgBytes)
+            ok = self.writer.enqueue(msgBytes)
+        else:
+            ok = False
+
+        if tracked and not ok:
+            self.tracker.untrack(msgCode)
+
+        return ok
+
+    def resendMsg(self, msgType: str, msgBody: dict, msgCode: str):
+        if self.engine:
+            return self.engine.sendMsg(msgType, msgBody, msgCode, isResend=1)
 
-    def msg_decode(self, msgBytes: bytes):
-        #     BF01|notify-to-frontend|0|1695899578730990${
-        #     "device-sn":"aaaa0001","CO":0.05,"HCl":0.01,"SO2":0.01}
-        msgStr = msgBytes.decode("ascii")
-        parts = msgStr.split("$", maxsplit=1)
-        if len(parts) != 2:
+        if not self.connected:
+            return False
+
+        msgBytes = self.encodeMsg(
+            msgType, msgBody, self.protocolVersion, msgCode, isResend=1
+        )
+        return self.writer.enqueue(msgBytes)
+
+    def msg_split(self, msgBytes: bytes):
+        """
+        拆分消息头和消息体，消息体不解码
+
+        消息头格式 : 版本|消息类型|是否重发|消息编号[|设备编号]
+        第5个字段 设备编号 是可选的，网关带上时可以直接按它分发，不用扫描消息体
+        """
+        headerEnd = msgBytes.find(b"$")
+        if headerEnd < 0:
             raise Exception("消息格式错误，没有$分隔符")
 
-        msgHeaderStr, msgBodyStr = parts
-        parts = msgHeaderStr.split("|")
-        if len(parts) != 4:
+        parts = msgBytes[:headerEnd].decode("ascii").split("|")
+        if len(parts) == 4:
+            parts.append(None)
+        elif len(parts) != 5:
             raise Exception("消息头格式错误")
 
-        version, msgType, isResend, msgCode = parts
-        # print(msgBodyStr)
-        msgBody = json.loads(msgBodyStr)
+        version, msgType, isResend, msgCode, deviceSn = parts
+        return version, msgType, isResend, msgCode, deviceSn, msgBytes[headerEnd + 1 :]
+
+    def msg_decode(self, msgBytes):
+        #     BF01|notify-to-frontend|0|1695899578730990${
+        #     "device-sn":"aaaa0001","CO":0.05,"HCl":0.01,"SO2":0.01}
+        version, msgType, isResend, msgCode, deviceSn, msgBodyBytes = self.msg_split(
+            bytes(msgBytes)
+        )
+        # print(msgBodyBytes)
+        msgBody = self.body_decode(version, msgBodyBytes)
+
+        return msgType, msgCode, msgBody
+
+    def body_decode(self, version, msgBodyBytes):
+        if version == binproto.VERSION:
+            return binproto.decodeBody(msgBodyBytes)
+        return json.loads(msgBodyBytes)
+
+    def handleFrame(self, msgBytes):
+        """
+        处理一条消息，返回解码结果 (msgType, msgCode, msgBody)
+        解码失败，或者是不在界面上的设备的消息而被跳过，返回 None
+        """
+        capture = self.capture
+        if capture is not None:
+            capture.write(msgBytes)
+
+        try:
+            version, msgType, isResend, msgCode, deviceSn, msgBodyBytes = (
+                self.msg_split(bytes(msgBytes))
+            )
+
+            if msgType == "notify-to-frontend":
+                # 先取出 device-sn 判断是否需要处理，不需要的消息不做json解码
+                if deviceSn is None:
+                    if version == binproto.VERSION:
+                        deviceSn = binproto.peekDeviceSn(msgBodyBytes)
+                    else:
+                        deviceSn = peekDeviceSn(msgBodyBytes)
+                if (
+                    deviceSn is not None
+                    and deviceSn != "stats"
+                    and deviceSn not in gstore.deviceSn_to_item
+                ):
+                    self.framesSkipped += 1
+                    return None
+
+            msgBody = self.body_decode(version, msgBodyBytes)
+        except:
+            print(traceback.format_exc())
+            self.decodeFailures += 1
+            return None
+
+        self.framesDecoded += 1
+
+        if msgType == "notify-to-frontend":
+            self.dispatchNotify(msgBody)
+        elif msgType == STATS_DELTA_TYPE:
+            if not isStatsDelta(msgBody):
+                print(f"stats-delta 消息体格式错误 : {msgBody!r:.100}")
+                self.decodeFailures += 1
+                return None
+            counts = self.deviceMsgCounts
+            counts["stats"] = counts.get("stats", 0) + 1
+            historyStore.appendStats(msgBody, delta=True)
+            coalescer.putDelta("stats", msgBody)
+        elif msgType == CONTROL_ACK_TYPE:
+            self.tracker.ack(msgCode)
 
         return msgType, msgCode, msgBody
 
-    def connectionRun(
-        self,
-    ):
+    def startCapture(self, path):
+        from capture import CaptureWriter
+
+        self.stopCapture()
+        self.capture = CaptureWriter(path)
+        print(f"capturing frames to {path}")
+
+    def stopCapture(self):
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
 
+    def dispatchNotify(self, msgBody):
+        # 合法的 json，但不是对象
+        if not isinstance(msgBody, dict):
+            print(f"消息体格式错误 : {msgBody!r:.100}")
+            self.decodeFailures += 1
+            return
+
+        deviceSn = msgBody.get("device-sn")
+        if not deviceSn:
+            print("device-sn 字段缺失")
+            self.missingDeviceSn += 1
+            return
+
+        if deviceSn != "stats" and deviceSn not in gstore.deviceSn_to_item:
+            # print(f'device-sn : {deviceSn} 不存在')
+            self.framesSkipped += 1
+            return
+
+        counts = self.deviceMsgCounts
+        counts[deviceSn] = counts.get(deviceSn, 0) + 1
+
+        # 合并之前记录读数历史，每条消息都保留
+        if deviceSn == "stats":
+            historyStore.appendStats(msgBody)
+        else:
+            telemetry.record(deviceSn, msgBody)
+            historyStore.append(deviceSn, msgBody)
+
+        # 同一设备只保留最新消息，由界面线程定时取走处理
+        coalescer.put(deviceSn, msgBody)
+
+    def connect(self):
         self.connected = False
 
-        recvbuffer = b""
         # 实例化一个socket对象，指明协议
         self.dataSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        # 连接服务端socket
-        self.dataSocket.connect((IP, SERVER_PORT))
+        # 连接服务端socket，连接阶段设置超时，避免网关无响应时长时间卡住
+        self.dataSocket.settimeout(CONNECT_TIMEOUT)
+        try:
+            self.dataSocket.connect((IP, SERVER_PORT))
+        except:
+            self.dataSocket.close()
+            raise
+        self.dataSocket.settimeout(None)
+
         print("connection to server ok")
+        self.writer.attach(self.dataSocket)
+        self.writer.start()
         self.connected = True
 
+        # 协商协议版本，老的网关不认识 negotiate 消息，不会回复，继续使用 BF01
+        self.protocolVersion = "BF01"
+        self.sendMsg("negotiate", {"versions": SUPPORTED_VERSIONS})
+
+    def receiveLoop(self):
+        """接收并处理消息，直到连接断开，返回断开的原因"""
+        framer = Framer(RECV_SIZE)
+
         while True:
 
             try:
                 # 等待接收服务端的消息
-                recved = self.dataSocket.recv(BUFLEN)
+                recvLen = framer.recvFrom(self.dataSocket)
             except socket.timeout:
                 continue
-            except:
+            except Exception as e:
                 print(traceback.format_exc())
+                reason = repr(e)
                 break
 
-            # 如果返回空bytes，表示对方关闭了连接
-            if not recved:
+            # 如果返回0字节，表示对方关闭了连接
+            if not recvLen:
                 print("server closed connection")
+                reason = "server closed connection"
                 break
-            # 打印读取的信息
 
-            recvbuffer += recved
+            self.bytesReceived += recvLen
 
             # 循环处理当前buffer里面的完整消息
-            while True:
+            for msgBytes in framer.frames():
+                decoded = self.handleFrame(msgBytes)
+                if decoded and decoded[0] == "negotiate":
+                    self.protocolVersion = negotiatedVersion(decoded[2])
 
-                endPos = recvbuffer.find(b"\x04")
+        self.disconnect()
+        return reason
 
-                # 还没有接收到完整的消息
-                if endPos < 0:
-                    break
+    def disconnect(self):
+        self.connected = False
+        self.writer.detach()
+        self.dataSocket.close()
 
-                # 接收到完整的消息
-                msgBytes = recvbuffer[:endPos]
-                # print('\n收到消息', msgBytes)
-                recvbuffer = recvbuffer[endPos + 1 :]
+    def connectionRun(
+        self,
+    ):
+        self.connect()
+        self.receiveLoop()
 
-                # 处理这个消息
-                try:
-                    msgType, msgCode, msgBody = self.msg_decode(msgBytes)
-                except:
-                    print(traceback.format_exc())
-                    continue
 
-                if msgType == "notify-to-frontend":
-                    deviceSn = msgBody.get("device-sn")
-                    if not deviceSn:
-                        print("device-sn 字段缺失")
-                        continue
+class ReconnectSupervisor:
+    """
+    负责连接和断线重连
 
-                    if deviceSn == "stats":
-                        gstore.main_window.dso.mdata_change.emit(msgBody)
-                        continue
+    连接失败或断开后，按指数退避等待一段时间再重连，避免网关不在线时
+    连接线程空转占满CPU。同时记录连接状态和计数，供界面显示。
+    """
 
-                    if deviceSn not in gstore.deviceSn_to_item:
-                        # print(f'device-sn : {deviceSn} 不存在')
-                        continue
+    def __init__(
+        self,
+        connector,
+        baseDelay=RECONNECT_BASE_DELAY,
+        maxDelay=RECONNECT_MAX_DELAY,
+        factor=2.0,
+        jitter=0.5,
+        stableTime=10.0,
+    ):
+        self.connector = connector
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.factor = factor
+        self.jitter = jitter  # 等待时间随机缩短的最大比例，避免多个终端同时重连
+        self.stableTime = stableTime  # 连接保持超过这个时间，退避次数清零
+
+        self.stopEvent = threading.Event()
+
+        # 连接状态 : idle / connecting / connected / waiting / stopped
+        self.state = "idle"
+        self.attempts = 0  # 连接尝试总次数
+        self.failures = 0  # 连续失败次数，决定下次等待时间
+        self.connects = 0  # 连接成功总次数
+        self.lastError = ""
+        self.connectedAt = None  # 本次连接建立的时间
+        self.disconnectedAt = None  # 上次断开的时间
+        self.lastReconnectTime = None  # 上次从断开到重新连上的耗时
+        self.nextRetryAt = None
+
+    def nextDelay(self):
+        return backoffDelay(
+            self.failures, self.baseDelay, self.maxDelay, self.factor, self.jitter
+        )
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "connects": self.connects,
+            "failures": self.failures,
+            "lastError": self.lastError,
+            "uptime": now - self.connectedAt if self.state == "connected" else 0,
+            "lastReconnectTime": self.lastReconnectTime,
+            "nextRetryIn": (
+                max(0, self.nextRetryAt - now) if self.state == "waiting" else None
+            ),
+        }
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.state = "connecting"
+            self.attempts += 1
+            try:
+                self.connector.connect()
+            except Exception as e:
+                # ConnectionRefusedError 是网关未启动，属于正常情况，不打印堆栈
+                if not isinstance(e, (ConnectionRefusedError, socket.timeout)):
+                    print(traceback.format_exc())
+                self.lastError = repr(e)
+                self.failures += 1
+                self.waitRetry()
+                continue
 
-                    gstore.deviceSn_to_item[deviceSn].dso.mdata_change.emit(msgBody)
+            now = time.monotonic()
+            self.connectedAt = now
+            self.connects += 1
+            if self.disconnectedAt is not None:
+                self.lastReconnectTime = now - self.disconnectedAt
+            self.state = "connected"
 
-        self.dataSocket.close()
+            try:
+                reason = self.connector.receiveLoop()
+            except Exception as e:
+                # 处理消息出错，和连接断开一样重连，不能让线程退出
+                print(traceback.format_exc())
+                reason = repr(e)
+                self.connector.disconnect()
+
+            now = time.monotonic()
+            self.disconnectedAt = now
+            self.lastError = reason
+            if now - self.connectedAt >= self.stableTime:
+                self.failures = 0
+            self.failures += 1
+            self.waitRetry()
+
+        self.state = "stopped"
+
+    def waitRetry(self):
+        delay = self.nextDelay()
+        self.state = "waiting"
+        self.nextRetryAt = time.monotonic() + delay
+        self.stopEvent.wait(delay)
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.connector.connected:
+            # 让阻塞的 recv 返回
+            try:
+                self.connector.dataSocket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 
 connector = Connector()
+supervisor = ReconnectSupervisor(connector)
+
+
+def connectionSnapshot():
+    if connector.engine:
+        return connector.engine.snapshot()
+    return supervisor.snapshot()
+
+
+def sendSnapshot():
+    if connector.engine:
+        return connector.engine.sendSnapshot()
+    return connector.writer.snapshot()
+
+
+@metrics.registry.register
+def collectMetrics():
+    c = connector
+    s = connectionSnapshot()
+    w = sendSnapshot()
+    q = coalescer.snapshot()
+    t = c.tracker.snapshot()
+
+    deviceCounts = dict(c.deviceMsgCounts)
+    controlLatency = []
+    for op, st in t["operations"].items():
+        for quantile in ("p50", "p95", "p99"):
+            controlLatency.append(
+                ({"operation": op, "quantile": f"0.{quantile[1:]}"}, st[quantile])
+            )
+        controlLatency.append(({"operation": op}, st["sum"], "_sum"))
+        controlLatency.append(({"operation": op}, st["total"], "_count"))
+
+    return [
+        ("bs_bytes_received_total", "counter", "接收的字节数", [({}, c.bytesReceived)]),
+        ("bs_frames_decoded_total", "counter", "解码的消息数", [({}, c.framesDecoded)]),
+        ("bs_decode_failures_total", "counter", "解码失败的消息数", [({}, c.decodeFailures)]),
+        (
+            "bs_frames_dropped_unknown_device_total",
+            "counter",
+            "不在界面上的设备的消息数",
+            [({}, c.framesSkipped)],
+        ),
+        (
+            "bs_frames_missing_device_sn_total",
+            "counter",
+            "缺少 device-sn 字段的消息数",
+            [({}, c.missingDeviceSn)],
+        ),
+        (
+            "bs_device_messages_total",
+            "counter",
+            "每个设备分发给界面的消息数",
+            [({"device_sn": sn}, n) for sn, n in deviceCounts.items()],
+        ),
+        ("bs_dispatch_pending", "gauge", "等待界面处理的设备数", [({}, q["pending"])]),
+        ("bs_dispatch_merged_total", "counter", "被同一设备新消息覆盖的消息数", [({}, q["merged"])]),
+        ("bs_dispatch_delivered_total", "counter", "界面处理的消息数", [({}, q["delivered"])]),
+        ("bs_connected", "gauge", "是否已连接网关", [({}, s["state"] == "connected")]),
+        ("bs_connect_attempts_total", "counter", "连接尝试次数", [({}, s["attempts"])]),
+        ("bs_reconnects_total", "counter", "重连成功次数", [({}, max(0, s["connects"] - 1))]),
+        ("bs_send_queue_depth", "gauge", "发送队列中的消息数", [({}, w["queued"])]),
+        ("bs_send_rejected_total", "counter", "发送队列满被拒绝的消息数", [({}, w["rejected"])]),
+        ("bs_control_timeouts_total", "counter", "控制命令超时次数", [({}, t["timeouts"])]),
+        ("bs_control_latency_seconds", "summary", "控制命令往返延迟", controlLatency),
+    ]
 
 
-def connectThread():
-    while True:
-        try:
-            connector.connectionRun()
-        except ConnectionRefusedError:
-            pass
-        except:
-            print(traceback.format_exc())
-            pass
+def startCommunicationThread():
+    if len(GATEWAYS) > 1:
+        from aioconnector import AsyncConnectorEngine
 
+        connector.engine = AsyncConnectorEngine(connector, GATEWAYS)
+        connector.engine.start()
+        return
 
-def startCommunicationThread():
-    thread = threading.Thread(target=connectThread, daemon=True)
+    thread = threading.Thread(target=supervisor.run, daemon=True)
     thread.start()
@@ -0,0 +1,364 @@
+"""
+设备读数磁盘存储
+
+按 天/设备 分区，每个字段一个只追加的 float64 列文件，时间列 t 和读数列按行对齐 :
+
+    history/2024-05-01/<设备编号>/t.f8
+    history/2024-05-01/<设备编号>/CO.f8
+    ...
+
+接收线程只把消息放进队列，由后台线程批量写入，队列满时丢弃并计数，不会阻塞接收。
+打开的列文件总数不超过 gstore.historyMaxOpenFiles，超过时关闭最久没写入的分区，
+超过 gstore.historyRetentionDays 天的日期目录由写入线程删除。
+查询时用 np.memmap 映射列文件，按时间二分定位范围，再分桶计算 最小/最大/平均值，
+只读取查询范围内的数据。
+"""
+
+import datetime
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from urllib.parse import quote
+
+import numpy as np
+
+import metrics
+from share import gstore
+from telemetry import FIELDS
+
+DTYPE = np.dtype("<f8")
+NAN = float("nan")
+# stats 数组字段
+STATS_FIELDS = ("coal-1", "coal-2", "w-used", "e-used")
+
+
+def dayOf(ts):
+    return datetime.date.fromtimestamp(ts).isoformat()
+
+
+def writeAll(f, data):
+    """不带缓冲的文件一次 write 可能只写了一部分，写完为止，磁盘满时抛出 OSError"""
+    view = memoryview(data)
+    while view:
+        written = f.write(view)
+        if not written:
+            raise OSError(f"写入 {f.name} 失败")
+        view = view[written:]
+
+
+class Partition:
+    """一个 天/设备 分区的列文件，只由写入线程使用"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = {}
+
+        # 时间列最后写入，已有的行数以时间列为准。
+        # 上次异常退出时读数列可能多写了没提交的行，或者少写了，对齐到相同行数
+        tPath = os.path.join(path, "t.f8")
+        self.rows = os.path.getsize(tPath) // DTYPE.itemsize if os.path.exists(tPath) else 0
+        for fileName in os.listdir(path):
+            if fileName.endswith(".f8"):
+                with open(os.path.join(path, fileName), "ab", buffering=0) as f:
+                    self.align(f)
+                self.files[fileName[:-3]] = None
+        # 上次写入失败，列文件可能没对齐，下次写入前先对齐
+        self.dirty = False
+
+    def align(self, f):
+        """列文件对齐到 self.rows 行，多出来的截掉，缺少的补 NaN，不会把没写入的行读成 0"""
+        size = f.seek(0, os.SEEK_END)
+        expected = self.rows * DTYPE.itemsize
+        if size > expected:
+            f.truncate(expected)
+        elif size < expected:
+            # 最后一个值可能只写了一半
+            whole = size // DTYPE.itemsize
+            f.truncate(whole * DTYPE.itemsize)
+            writeAll(f, np.full(self.rows - whole, NAN, DTYPE).tobytes())
+
+    def column(self, name):
+        f = self.files.get(name)
+        if f is None:
+            # 不带缓冲，写入顺序就是落盘顺序，时间列一定最后写
+            f = self.files[name] = open(os.path.join(self.path, f"{name}.f8"), "ab", buffering=0)
+            # 中途新增的列，之前的行补 NaN
+            self.align(f)
+        return f
+
+    def openFiles(self):
+        return sum(f is not None for f in self.files.values())
+
+    def append(self, rows):
+        """rows : [(ts, {字段名 : 值})]"""
+        if self.dirty:
+            for name in list(self.files):
+                self.align(self.column(name))
+
+        names = set(self.files)
+        for _, values in rows:
+            names.update(values)
+        names.discard("t")
+
+        # 先写读数列，最后写时间列，时间列写完这些行才算提交
+        self.dirty = True
+        for name in names:
+            column = np.array([values.get(name, NAN) for _, values in rows], DTYPE)
+            writeAll(self.column(name), column.tobytes())
+        writeAll(self.column("t"), np.array([ts for ts, _ in rows], DTYPE).tobytes())
+        self.rows += len(rows)
+        self.dirty = False
+
+    def close(self):
+        for name, f in self.files.items():
+            if f is not None:
+                f.close()
+                self.files[name] = None
+
+
+class HistoryStore:
+    def __init__(self, queueSize=100000, maxOpenFiles=256, retentionDays=0):
+        self.root = None
+        self.queue = queue.Queue(queueSize)
+        # 每列一个文件，按打开的文件数限制，不按分区数，避免超过进程的文件描述符上限
+        self.maxOpenFiles = maxOpenFiles
+        # 保留的天数，0 一直保留
+        self.retentionDays = retentionDays
+        self.lastPurge = 0.0
+        # (日期, 设备编号) : Partition，打开的文件超过上限时关闭最久没写入的
+        self.partitions = OrderedDict()
+        self.openFiles = 0
+
+        # 统计
+        self.appended = 0
+        self.dropped = 0
+        self.written = 0
+        self.writeErrors = 0
+
+    def start(self, root):
+        self.root = root
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def partitionPath(self, day, deviceSn):
+        return os.path.join(self.root, day, quote(deviceSn, safe=""))
+
+    # ----- 接收线程调用 -----
+
+    def append(self, deviceSn, msgBody):
+        if self.root is None:
+            return
+
+        values = {}
+        for name in FIELDS:
+            value = msgBody.get(name)
+            if type(value) in (int, float):
+                values[name] = value
+        if values:
+            self.put(deviceSn, values)
+
+    def appendStats(self, msgBody, delta=False):
+        """完整 stats 消息记录每个数组最新的点，stats-delta 记录全部新的点"""
+        if self.root is None:
+            return
+
+        arrays = {}
+        for name in STATS_FIELDS:
+            value = msgBody.get(name)
+            if isinstance(value, list) and value:
+                arrays[name] = value
+        if not arrays:
+            return
+        count = max(len(v) for v in arrays.values()) if delta else 1
+        for i in range(-count, 0):
+            # 和 append 一样只记录数字，不是数字的点跳过
+            values = {name: v[i] for name, v in arrays.items() if len(v) >= -i and type(v[i]) in (int, float)}
+            if values:
+                self.put("stats", values)
+
+    def put(self, deviceSn, values):
+        try:
+            self.queue.put_nowait((time.time(), deviceSn, values))
+            self.appended += 1
+        except queue.Full:
+            self.dropped += 1
+
+    # ----- 写入线程 -----
+
+    def run(self):
+        while True:
+            if self.retentionDays and time.monotonic() - self.lastPurge > 3600:
+                self.lastPurge = time.monotonic()
+                try:
+                    self.purge()
+                except:
+                    print(traceback.format_exc())
+
+            try:
+                batch = [self.queue.get(timeout=60)]
+            except queue.Empty:
+                continue
+            try:
+                while len(batch) < 10000:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                self.write(batch)
+            except:
+                print(traceback.format_exc())
+                self.writeErrors += 1
+
+    def write(self, batch):
+        groups = {}
+        for ts, deviceSn, values in batch:
+            groups.setdefault((dayOf(ts), deviceSn), []).append((ts, values))
+
+        for key, rows in groups.items():
+            partition = self.partitions.get(key)
+            if partition is None:
+                partition = self.partitions[key] = Partition(self.partitionPath(*key))
+            else:
+                self.partitions.move_to_end(key)
+
+            # 一个分区写入失败只丢弃这个分区的行，不影响同一批的其他分区
+            opened = partition.openFiles()
+            try:
+                partition.append(rows)
+                self.written += len(rows)
+            except:
+                print(traceback.format_exc())
+                self.writeErrors += 1
+            finally:
+                self.openFiles += partition.openFiles() - opened
+                self.closeIdle()
+
+    def closeIdle(self):
+        """打开的文件超过上限时，关闭最久没写入的分区，当前写入的分区保留"""
+        while self.openFiles > self.maxOpenFiles and len(self.partitions) > 1:
+            self.closePartition(next(iter(self.partitions)))
+
+    def closePartition(self, key):
+        partition = self.partitions.pop(key)
+        self.openFiles -= partition.openFiles()
+        partition.close()
+
+    def purge(self):
+        """删除超过保留天数的日期目录"""
+        cutoff = (datetime.date.today() - datetime.timedelta(days=self.retentionDays)).isoformat()
+        for key in [key for key in self.partitions if key[0] < cutoff]:
+            self.closePartition(key)
+
+        for day in os.listdir(self.root):
+            # 只删除日期格式的目录
+            try:
+                datetime.date.fromisoformat(day)
+            except ValueError:
+                continue
+            if day < cutoff:
+                shutil.rmtree(os.path.join(self.root, day), ignore_errors=True)
+                print(f"history : 删除超过 {self.retentionDays} 天的 {day}")
+
+    # ----- 查询，任意线程调用 -----
+
+    def days(self, start, end):
+        day = datetime.date.fromtimestamp(start)
+        last = datetime.date.fromtimestamp(end)
+        while day <= last:
+            yield day.isoformat()
+            day += datetime.timedelta(days=1)
+
+    def load(self, deviceSn, field, start, end):
+        """返回 [start, end) 范围内的 (时间数组, 读数数组)，列文件只映射、不整体读入"""
+        ts, vs = [], []
+        for day in self.days(start, end):
+            path = self.partitionPath(day, deviceSn)
+            tPath = os.path.join(path, "t.f8")
+            vPath = os.path.join(path, f"{field}.f8")
+            if not (os.path.exists(tPath) and os.path.exists(vPath)):
+                continue
+
+            # 写入线程可能正在追加，按两列都写完的行数读取
+            rows = min(os.path.getsize(tPath), os.path.getsize(vPath)) // DTYPE.itemsize
+            if rows == 0:
+                continue
+            t = np.memmap(tPath, DTYPE, "r", shape=(rows,))
+            v = np.memmap(vPath, DTYPE, "r", shape=(rows,))
+            lo, hi = np.searchsorted(t, [start, end])
+            if hi > lo:
+                ts.append(np.array(t[lo:hi]))
+                vs.append(np.array(v[lo:hi]))
+
+        if not ts:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(ts), np.concatenate(vs)
+
+    def fields(self, deviceSn, start, end):
+        names = set()
+        for day in self.days(start, end):
+            path = self.partitionPath(day, deviceSn)
+            if os.path.isdir(path):
+                names.update(f[:-3] for f in os.listdir(path) if f.endswith(".f8"))
+        names.discard("t")
+        return sorted(names)
+
+    def query(self, deviceSn, field, start, end, buckets):
+        """
+        把 [start, end) 分为 buckets 个时间段，返回有数据的时间段的
+        (中点时间, 最小值, 最大值, 平均值) 四个数组，NaN 不参与计算
+        """
+        t, v = self.load(deviceSn, field, start, end)
+        if len(t) == 0:
+            empty = np.empty(0)
+            return empty, empty, empty, empty
+
+        edges = np.linspace(start, end, buckets + 1)
+        bounds = np.searchsorted(t, edges[:-1])
+        counts = np.diff(np.append(bounds, len(t)))
+        nonEmpty = counts > 0
+        bounds = bounds[nonEmpty]
+
+        valid = ~np.isnan(v)
+        sums = np.add.reduceat(np.where(valid, v, 0.0), bounds)
+        validCounts = np.add.reduceat(valid.astype(np.int64), bounds)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / validCounts
+        mins = np.fmin.reduceat(v, bounds)
+        maxs = np.fmax.reduceat(v, bounds)
+
+        centers = (edges[:-1] + edges[1:])[nonEmpty] / 2
+        return centers, mins, maxs, means
+
+    def snapshot(self):
+        return {
+            "appended": self.appended,
+            "dropped": self.dropped,
+            "written": self.written,
+            "queued": self.queue.qsize(),
+            "writeErrors": self.writeErrors,
+            "openFiles": self.openFiles,
+        }
+
+
+historyStore = HistoryStore(
+    maxOpenFiles=gstore.historyMaxOpenFiles, retentionDays=gstore.historyRetentionDays
+)
+
+
+@metrics.registry.register
+def collectMetrics():
+    s = historyStore.snapshot()
+    return [
+        ("bs_store_appended_total", "counter", "放入磁盘写入队列的读数行数", [({}, s["appended"])]),
+        ("bs_store_dropped_total", "counter", "写入队列满丢弃的读数行数", [({}, s["dropped"])]),
+        ("bs_store_written_total", "counter", "写入磁盘的读数行数", [({}, s["written"])]),
+        ("bs_store_queue_depth", "gauge", "等待写入磁盘的读数行数", [({}, s["queued"])]),
+        ("bs_store_write_errors_total", "counter", "磁盘写入失败次数", [({}, s["writeErrors"])]),
+        ("bs_store_open_files", "gauge", "打开的列文件数", [({}, s["openFiles"])]),
+    ]
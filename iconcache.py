@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+from PySide6 import QtGui
+from PySide6.QtCore import Qt
+
+import metrics
+from share import gstore
+
+ICON_DIR = "./images"
+
+
+class IconCache:
+    """
+    设备图标缓存
+
+    每个图标的 png 只解码一次，原图全进程共用一份。
+    缩放后的图按 (图标名, 宽度) 缓存，超过上限时淘汰最久没用到的。
+    QPixmap 是隐式共享的，淘汰后已经在显示的 item 仍然共用同一份数据。
+    """
+
+    def __init__(self, maxScaled=256):
+        self.maxScaled = maxScaled
+        # 图标名 : 原图
+        self.originals = {}
+        # (图标名, 宽度) : 缩放后的图
+        self.scaled = OrderedDict()
+        # 图标名 : 平均颜色，缩小显示时代替图标画色块
+        self.colors = {}
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0  # 从文件解码的次数
+        self.evictions = 0
+
+    def original(self, name):
+        pixmap = self.originals.get(name)
+        if pixmap is None:
+            pixmap = self.originals[name] = QtGui.QPixmap(f"{ICON_DIR}/{name}.png")
+            self.loads += 1
+        return pixmap
+
+    def get(self, name, width):
+        """返回缩放到 width 宽度的图标，高度等比例缩放"""
+        key = (name, width)
+        pixmap = self.scaled.get(key)
+        if pixmap is not None:
+            self.scaled.move_to_end(key)
+            self.hits += 1
+            return pixmap
+
+        self.misses += 1
+        pixmap = self.original(name).scaledToWidth(width, Qt.SmoothTransformation)
+        self.scaled[key] = pixmap
+        if len(self.scaled) > self.maxScaled:
+            self.scaled.popitem(last=False)
+            self.evictions += 1
+        return pixmap
+
+    def color(self, name):
+        color = self.colors.get(name)
+        if color is None:
+            image = self.original(name).toImage().scaled(
+                1, 1, Qt.IgnoreAspectRatio, Qt.SmoothTransformation
+            )
+            color = image.pixelColor(0, 0)
+            color.setAlpha(255)
+            self.colors[name] = color
+        return color
+
+    def snapshot(self):
+        return {
+            "originals": len(self.originals),
+            "scaled": len(self.scaled),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+iconCache = IconCache(gstore.iconCacheSize)
+
+
+@metrics.registry.register
+def collectMetrics():
+    s = iconCache.snapshot()
+    return [
+        ("bs_icon_cache_originals", "gauge", "缓存的图标原图数", [({}, s["originals"])]),
+        ("bs_icon_cache_scaled", "gauge", "缓存的缩放后图标数", [({}, s["scaled"])]),
+        ("bs_icon_cache_hits_total", "counter", "缩放后图标命中缓存次数", [({}, s["hits"])]),
+        ("bs_icon_cache_loads_total", "counter", "从文件解码图标的次数", [({}, s["loads"])]),
+        ("bs_icon_cache_evictions_total", "counter", "淘汰的缩放后图标数", [({}, s["evictions"])]),
+    ]
@@ -0,0 +1,262 @@
+"""
+元件图 SQLite 容器
+
+cfg.json 要整个解析才能显示其中一部分，大型场地改用 SQLite 文件保存元件图 :
+
+    items      每个 item 一行，data 列原样保存 JSON 中的对象，seq 为叠放顺序(小的在上面)
+    items_pos  item 位置的 R 树空间索引，按区域查询不用扫描全部 item
+    device_sn  列有索引，按设备编号查找 item 不用解析整个元件图
+
+界面设置 gstore.layoutDbFile 后，只加载可见区域附近的 item，滚动、缩放时再加载新露出来的区域。
+保存时把编辑日志(见 layoutstore.py)的操作直接写入数据库。
+
+和 JSON 格式互相转换 :
+
+    python layoutdb.py to-db cfg.json cfg.db
+    python layoutdb.py to-json cfg.db cfg.json [--compact]
+    python layoutdb.py verify cfg.json cfg.db       # 检查两边内容是否一致
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+
+from layoutstore import dumpLayout, writeAtomic
+from share import gstore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id        INTEGER PRIMARY KEY,
+    seq       REAL NOT NULL,
+    uid       TEXT NOT NULL UNIQUE,
+    device_sn TEXT,
+    data      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_seq ON items(seq);
+CREATE INDEX IF NOT EXISTS items_device_sn ON items(device_sn);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_pos USING rtree(id, minX, maxX, minY, maxY);
+"""
+
+
+def itemPos(itemData):
+    """返回 item 的位置，格式不对返回 None，这样的 item 不进空间索引"""
+    pos = itemData.get("pos")
+    if isinstance(pos, list) and len(pos) == 2 and all(type(p) in (int, float) for p in pos):
+        return pos
+    return None
+
+
+def itemDeviceSn(itemData):
+    props = itemData.get("props")
+    if isinstance(props, dict):
+        return props.get("设备编号") or None
+    return None
+
+
+def loadItem(uid, data):
+    # 从 JSON 转换来的旧数据没有 uid 字段，data 保持原样，读出时再补上
+    itemData = json.loads(data)
+    itemData.setdefault("uid", uid)
+    return itemData
+
+
+class LayoutDB:
+    """
+    和 LayoutStore 一样提供 read / saveFull / append，界面可以直接替换使用，
+    另外提供按区域查询 query 和按设备编号查找 findDevice。
+    每次操作新建连接，工作线程和界面线程都可以调用
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """正常结束时提交，出错时回滚，最后关闭连接"""
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def insert(self, conn, seq, uid, itemData):
+        cursor = conn.execute(
+            "INSERT INTO items (seq, uid, device_sn, data) VALUES (?, ?, ?, ?)",
+            (seq, uid, itemDeviceSn(itemData), json.dumps(itemData, ensure_ascii=False)),
+        )
+        pos = itemPos(itemData)
+        if pos is not None:
+            x, y = pos
+            conn.execute("INSERT INTO items_pos VALUES (?, ?, ?, ?, ?)", (cursor.lastrowid, x, x, y, y))
+
+    def update(self, conn, uid, change):
+        row = conn.execute("SELECT id, data FROM items WHERE uid = ?", (uid,)).fetchone()
+        if row is None:
+            return
+        rowId, data = row
+        itemData = json.loads(data)
+        itemData.update(change)
+        conn.execute(
+            "UPDATE items SET device_sn = ?, data = ? WHERE id = ?",
+            (itemDeviceSn(itemData), json.dumps(itemData, ensure_ascii=False), rowId),
+        )
+        conn.execute("DELETE FROM items_pos WHERE id = ?", (rowId,))
+        pos = itemPos(itemData)
+        if pos is not None:
+            x, y = pos
+            conn.execute("INSERT INTO items_pos VALUES (?, ?, ?, ?, ?)", (rowId, x, x, y, y))
+
+    def delete(self, conn, uid):
+        row = conn.execute("SELECT id FROM items WHERE uid = ?", (uid,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM items WHERE id = ?", row)
+            conn.execute("DELETE FROM items_pos WHERE id = ?", row)
+
+    def clear(self, conn):
+        conn.execute("DELETE FROM items")
+        conn.execute("DELETE FROM items_pos")
+
+    # ----- 和 LayoutStore 相同的接口 -----
+
+    def read(self):
+        """返回全部 item，按从上到下的顺序"""
+        with self.connect() as conn:
+            rows = conn.execute("SELECT uid, data FROM items ORDER BY seq").fetchall()
+        return [loadItem(uid, data) for uid, data in rows]
+
+    def saveFull(self, data):
+        """用 data 替换全部 item，data 按从上到下的顺序"""
+        with self.connect() as conn:
+            self.clear(conn)
+            for seq, itemData in enumerate(data):
+                uid = itemData.get("uid") or f"#{seq}"
+                self.insert(conn, seq, uid, itemData)
+
+    def append(self, entries):
+        """应用编辑日志的操作，一个事务内完成"""
+        if not entries:
+            return
+
+        with self.connect() as conn:
+            for entry in entries:
+                op = entry.get("op")
+                if op == "add":
+                    itemData = entry["item"]
+                    # 新增的放在最上层
+                    top = conn.execute("SELECT MIN(seq) FROM items").fetchone()[0]
+                    self.delete(conn, itemData["uid"])
+                    self.insert(conn, (top if top is not None else 0) - 1, itemData["uid"], itemData)
+                elif op == "move":
+                    self.update(conn, entry["uid"], {"pos": entry["pos"]})
+                elif op == "props":
+                    self.update(conn, entry["uid"], {"props": entry["props"]})
+                elif op == "del":
+                    self.delete(conn, entry["uid"])
+                elif op == "clear":
+                    self.clear(conn)
+
+    # ----- 索引查询 -----
+
+    def query(self, region, exclude=()):
+        """
+        返回位置在 region (左, 上, 右, 下) 内的 item，按从上到下的顺序，跳过 uid 在 exclude 中的。
+        索引只有 item 的位置，区域向外扩大 gstore.layoutRegionMargin，
+        位置在可见区域外、但图形伸进来的 item 也能加载
+        """
+        margin = gstore.layoutRegionMargin
+        left, top, right, bottom = region
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT items.uid, items.data FROM items_pos JOIN items ON items.id = items_pos.id"
+                " WHERE items_pos.maxX >= ? AND items_pos.minX <= ?"
+                " AND items_pos.maxY >= ? AND items_pos.minY <= ?"
+                " ORDER BY items.seq",
+                (left - margin, right + margin, top - margin, bottom + margin),
+            ).fetchall()
+        return [loadItem(uid, data) for uid, data in rows if uid not in exclude]
+
+    def findDevice(self, deviceSn):
+        """返回有该设备编号的 item，没有返回 None"""
+        with self.connect() as conn:
+            row = conn.execute("SELECT uid, data FROM items WHERE device_sn = ? LIMIT 1", (deviceSn,)).fetchone()
+        return loadItem(*row) if row else None
+
+    def deviceSns(self):
+        with self.connect() as conn:
+            return [sn for (sn,) in conn.execute("SELECT device_sn FROM items WHERE device_sn IS NOT NULL")]
+
+    def bounds(self):
+        """所有 item 位置的范围 (左, 上, 右, 下)，没有 item 返回 None"""
+        with self.connect() as conn:
+            row = conn.execute("SELECT MIN(minX), MIN(minY), MAX(maxX), MAX(maxY) FROM items_pos").fetchone()
+        return None if row[0] is None else row
+
+
+# ----- 和 JSON 格式互相转换 -----
+
+
+def jsonToDb(jsonPath, dbPath):
+    """data 列原样保存 JSON 中的对象，转换回 JSON 内容不变"""
+    with open(jsonPath, "r", encoding="utf8") as f:
+        data = json.load(f)
+    if os.path.exists(jsonPath + ".journal"):
+        print(f"警告 : {jsonPath}.journal 中的改动没有合并进 {jsonPath}，不会转换")
+
+    # 先写临时文件，转换完成再替换
+    tmpPath = dbPath + ".tmp"
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    LayoutDB(tmpPath).saveFull(data)
+    os.replace(tmpPath, dbPath)
+    return len(data)
+
+
+def dbToJson(dbPath, jsonPath, compact=False):
+    with LayoutDB(dbPath).connect() as conn:
+        rows = conn.execute("SELECT data FROM items ORDER BY seq").fetchall()
+    data = [json.loads(d) for (d,) in rows]
+    writeAtomic(jsonPath, dumpLayout(data, compact))
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="元件图 JSON 和 SQLite 格式转换")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("to-db", help="JSON 转换为 SQLite")
+    p.add_argument("json")
+    p.add_argument("db")
+
+    p = sub.add_parser("to-json", help="SQLite 转换为 JSON")
+    p.add_argument("db")
+    p.add_argument("json")
+    p.add_argument("--compact", action="store_true", help="不缩进")
+
+    p = sub.add_parser("verify", help="检查两边内容是否一致")
+    p.add_argument("json")
+    p.add_argument("db")
+
+    args = parser.parse_args()
+    if args.command == "to-db":
+        print(f"converted {jsonToDb(args.json, args.db)} items")
+    elif args.command == "to-json":
+        print(f"converted {dbToJson(args.db, args.json, args.compact)} items")
+    else:
+        with open(args.json, "r", encoding="utf8") as f:
+            expected = json.load(f)
+        with LayoutDB(args.db).connect() as conn:
+            actual = [json.loads(d) for (d,) in conn.execute("SELECT data FROM items ORDER BY seq")]
+        if expected != actual:
+            print("different")
+            sys.exit(1)
+        print(f"identical, {len(actual)} items")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+元件图文件存储
+
+完整的元件图保存在基础文件(cfg.json)中，之后的编辑只追加到日志文件 cfg.json.journal，
+每行一个 JSON 操作 :
+
+    {"op": "add", "item": {...}}                  新增 item，放在最上层
+    {"op": "move", "uid": "...", "pos": [x, y]}   移动
+    {"op": "props", "uid": "...", "props": {...}} 修改属性
+    {"op": "del", "uid": "..."}                   删除
+    {"op": "clear"}                               清空
+
+保存只写入改动，耗时和改动多少有关，和元件图大小无关。
+日志超过 gstore.journalCompactEntries 条时，后台线程把日志合并进基础文件 :
+先把日志改名为 cfg.json.journal.compacting，新的编辑写入新的日志，
+合并完成后基础文件用临时文件加 os.replace 原子替换，再删除 .compacting 文件。
+任何时候异常退出，基础文件都是完整的，重新加载时再应用一遍遗留的日志，
+日志中的操作都是直接设置结果，重复应用结果不变。
+"""
+
+import json
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+
+from share import gstore
+
+
+def newUid():
+    return uuid.uuid4().hex[:12]
+
+
+def dumpLayout(data, compact):
+    if compact:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def writeAtomic(path, content):
+    """先写临时文件再替换，写入过程中异常退出不会损坏原文件"""
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+
+
+def readJournal(path):
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # 追加时异常退出，最后一行不完整
+                break
+    return entries
+
+
+def applyJournal(items, entries):
+    """items : uid : itemData，按从上到下的顺序"""
+    for entry in entries:
+        op = entry.get("op")
+        if op == "add":
+            itemData = entry["item"]
+            items[itemData["uid"]] = itemData
+            items.move_to_end(itemData["uid"], last=False)
+        elif op == "move":
+            itemData = items.get(entry["uid"])
+            if itemData is not None:
+                itemData["pos"] = entry["pos"]
+        elif op == "props":
+            itemData = items.get(entry["uid"])
+            if itemData is not None:
+                itemData["props"] = entry["props"]
+        elif op == "del":
+            items.pop(entry["uid"], None)
+        elif op == "clear":
+            items.clear()
+
+
+class LayoutStore:
+    def __init__(self, path):
+        self.path = path
+        self.journalPath = path + ".journal"
+        self.compactingPath = path + ".journal.compacting"
+
+        self.lock = threading.Lock()
+        self.journalEntries = len(readJournal(self.journalPath))
+        self.compacting = False
+        # 每次完整保存加一，合并期间有完整保存时放弃合并结果
+        self.generation = 0
+
+        # 统计
+        self.appended = 0
+        self.compactions = 0
+        self.compactErrors = 0
+
+        # 上次合并时异常退出，遗留的日志接着合并
+        if os.path.exists(self.compactingPath):
+            self.startCompaction()
+
+    def readBase(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r", encoding="utf8") as f:
+            return f.read()
+
+    def parseBase(self, content):
+        """返回基础文件的 uid : itemData，没有 uid 的旧文件按序号生成固定的 uid"""
+        items = OrderedDict()
+        if content is None:
+            return items
+
+        data = json.loads(content)
+        if not isinstance(data, list):
+            raise ValueError("元件图格式错误，应为数组")
+
+        for index, itemData in enumerate(data):
+            if isinstance(itemData, dict):
+                uid = itemData.setdefault("uid", f"#{index}")
+                items[uid] = itemData
+        return items
+
+    def read(self):
+        """返回合并了日志的元件图，按从上到下的顺序，和完整保存的内容相同"""
+        with self.lock:
+            items = self.parseBase(self.readBase())
+            applyJournal(items, readJournal(self.compactingPath))
+            applyJournal(items, readJournal(self.journalPath))
+        return list(items.values())
+
+    def saveFull(self, data):
+        """完整保存，替换基础文件并清空日志"""
+        content = dumpLayout(data, gstore.layoutCompact)
+        with self.lock:
+            writeAtomic(self.path, content)
+            for path in (self.journalPath, self.compactingPath):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.journalEntries = 0
+            self.generation += 1
+
+    def append(self, entries):
+        """追加编辑操作到日志"""
+        if not entries:
+            return
+
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        with self.lock:
+            with open(self.journalPath, "a", encoding="utf8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.journalEntries += len(entries)
+            self.appended += len(entries)
+            needCompact = self.journalEntries >= gstore.journalCompactEntries
+
+        if needCompact:
+            self.startCompaction()
+
+    # ----- 后台合并 -----
+
+    def startCompaction(self):
+        with self.lock:
+            if self.compacting:
+                return
+            self.compacting = True
+        thread = threading.Thread(target=self.threadCompact, daemon=True)
+        thread.start()
+
+    def threadCompact(self):
+        try:
+            self.compact()
+        except:
+            print(traceback.format_exc())
+            self.compactErrors += 1
+        finally:
+            self.compacting = False
+
+    def compact(self):
+        with self.lock:
+            # 上次遗留的 .compacting 先合并，当前日志留到下次
+            if not os.path.exists(self.compactingPath):
+                if not os.path.exists(self.journalPath):
+                    return
+                os.replace(self.journalPath, self.compactingPath)
+                self.journalEntries = 0
+            generation = self.generation
+            base = self.readBase()
+            entries = readJournal(self.compactingPath)
+
+        # 耗时的解析、序列化不占用锁，不阻塞保存
+        items = self.parseBase(base)
+        applyJournal(items, entries)
+        content = dumpLayout(list(items.values()), gstore.layoutCompact)
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            writeAtomic(self.path, content)
+            os.remove(self.compactingPath)
+            self.compactions += 1
+
+    def snapshot(self):
+        return {
+            "journalEntries": self.journalEntries,
+            "appended": self.appended,
+            "compactions": self.compactions,
+            "compactErrors": self.compactErrors,
+            "compacting": self.compacting,
+        }
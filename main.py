@@ -3,11 +3,22 @@ from PySide6.QtCore import Qt, Signal, QObject, QRectF, QTimer, QPoint
 import qtawesome as qta
 import pyqtgraph as pg
 import shiboken6
-import json
+import math
+import threading
+import time
+import traceback
+from collections import deque
 
 from share import gstore
 
-from connector import connector
+from connector import connector, connectionSnapshot, sendSnapshot
+from coalescer import coalescer
+from iconcache import iconCache
+from series import SeriesStore
+from telemetry import telemetry
+from historystore import historyStore
+from layoutstore import LayoutStore, newUid
+from layoutdb import LayoutDB
 
 PIC_LIST = [
     'gas-meter', 'temp-meter',
@@ -17,7 +28,36 @@ PIC_LIST = [
     'hydrant', 'pipeline'
 ]
 
+# 水箱、风泵绘制用的共享画笔画刷，paint 时不再每次新建
+PEN_PUMP     = QtGui.QPen(QtGui.QColor('#4c8bbe'), 1)
+PEN_MASK     = QtGui.QPen(QtGui.QColor('white'), 2)
+PEN_FAN      = QtGui.QPen(QtGui.QColor('gray'), 1)
+PEN_WATER    = QtGui.QPen(QtGui.QColor('#d0ffff'))
+PEN_TEXT     = QtGui.QPen(QtGui.QColor('black'))
+BRUSH_NONE   = QtGui.QBrush(Qt.NoBrush)
+BRUSH_WHITE  = QtGui.QBrush(QtGui.QColor('white'))
+BRUSH_BTN_ON = QtGui.QBrush(QtGui.QColor('#6DCDDC'))
+BRUSH_WATER  = QtGui.QBrush(QtGui.QColor('#d0ffff'))
+# 风泵底座
+PUMP_BASE = QtGui.QPolygon([QPoint(10, 60), QPoint(1, 95), QPoint(79, 95), QPoint(70, 60)])
+# 缩小显示时代替设备图形的色块
+COLOR_TANK_GLYPH = QtGui.QColor('#9cb8cc')
+COLOR_WATER_GLYPH = QtGui.QColor('#6DCDDC')
+COLOR_PUMP_GLYPH = QtGui.QColor('#4c8bbe')
+
+
+# 统计曲线只画可见范围内的点，点数多于像素时按峰值降采样
+STATS_CURVE_OPTIONS = dict(clipToView=True, autoDownsample=True, downsampleMethod='peak')
+
+
+def isLowDetail(option, painter):
+    # 缩小到 gstore.lodScale 以下时，设备只画简单的色块，不画细节和文字
+    return option.levelOfDetailFromTransform(painter.worldTransform()) < gstore.lodScale
+
 class Item:
+    # 元件图中唯一的编号，编辑日志按它记录改动
+    uid = None
+
     def keyPressEvent(self, e):
 
         if window.mode == 'view':
@@ -44,27 +84,55 @@ class Item:
             # 设置属性框内容
             window.setPropTable(self.props)
 
+        # 被移动
+        elif change == QtWidgets.QGraphicsItem.ItemPositionHasChanged:
+            window.markEdited(self, 'move')
 
         return super().itemChange(change, value)
 
     def toSaveData(self):
         pos = self.pos()
         return {
+            'uid': self.uid,
             'type': self.__class__.__name__,
             'pos':  [pos.x(),pos.y()],
             'props': self.props
         }
 
 
-# 自定义信号源对象类型，一定要继承自 QObject
-class DeviceSignalObject(QObject):
-    mdata_change = Signal(dict)
+class StaticBodyItem(QtWidgets.QGraphicsItem):
+    '''
+    设备图形中不变的部分，作为子item画在父item下面
+
+    使用 Qt 的 item 缓存，父item因为数据变化重绘时，这部分直接用缓存的图像
+    '''
+    def __init__(self, parent, rect, paintFunc):
+        super().__init__(parent)
+        self.rect = rect
+        self.paintFunc = paintFunc
+
+        self.setFlag(QtWidgets.QGraphicsItem.ItemStacksBehindParent, True)
+        self.setCacheMode(QtWidgets.QGraphicsItem.DeviceCoordinateCache)
+        # 鼠标事件交给父item处理
+        self.setAcceptedMouseButtons(Qt.NoButton)
+
+    def paint(self, painter, option, widget):
+        # 缩小显示时由父item画色块
+        if isLowDetail(option, painter):
+            return
+        self.paintFunc(painter)
+
+    def boundingRect(self):
+        return self.rect
 
 
 class WaterTankItem(Item, QtWidgets.QGraphicsItem):
     def __init__(self):
         super().__init__()
-        self.waterPercent = 0.9
+        self.setWaterPercent(0.9)
+
+        # 水箱外壳
+        self.body = StaticBodyItem(self, self.boundingRect(), self.paintBody)
 
 
         self.props = {
@@ -72,9 +140,6 @@ class WaterTankItem(Item, QtWidgets.QGraphicsItem):
             '设备编号' : ''
         }
 
-        self.dso = DeviceSignalObject()
-        self.dso.mdata_change.connect(self.handleNotify)
-
 
     def loadData(self,data):
         # 设置props
@@ -112,35 +177,52 @@ class WaterTankItem(Item, QtWidgets.QGraphicsItem):
             return
 
 
+    # 只更新状态，重绘由 RenderScheduler 统一触发
     def handleNotify(self, msg):
-        self.waterPercent = msg['water-amount']
-        self.update()
+        self.setWaterPercent(msg['water-amount'])
 
-    # 设定控件显示内容
-    def paint(self, painter, option, widget):
-        # 选中状态，画选中方框
-        if self.isSelected():
-            painter.drawRect(1, 1, 78, 93)
+    def mouseDoubleClickEvent(self, e):
+        deviceSn = self.props.get('设备编号')
+        if deviceSn:
+            window.showTrend(deviceSn)
+
+    def setWaterPercent(self, waterPercent):
+        # 水位和文字在数据变化时算好，paint 里直接用
+        self.waterPercent = waterPercent
+        self.waterHeight = int(waterPercent * (60-2))
+        self.waterY = 75-1-self.waterHeight
+        self.percentText = f'{waterPercent*100:.1f}%'
 
+    @staticmethod
+    def paintBody(painter):
         # 画上下椭圆截面
         painter.drawEllipse(5, 5, 70, 22)
         painter.drawEllipse(5, 63, 70, 22)
 
         # 画水箱正面矩形体
-        painter.setBrush(QtGui.QBrush(Qt.white))
+        painter.setBrush(BRUSH_WHITE)
         painter.drawRect(5, 15, 70, 60)
 
+    # 设定控件显示内容，外壳由 self.body 画
+    def paint(self, painter, option, widget):
+        if isLowDetail(option, painter):
+            painter.fillRect(5, 5, 70, 80, COLOR_TANK_GLYPH)
+            painter.fillRect(5, self.waterY, 70, self.waterHeight, COLOR_WATER_GLYPH)
+            return
+
+        # 选中状态，画选中方框
+        if self.isSelected():
+            painter.setBrush(BRUSH_NONE)
+            painter.drawRect(1, 1, 78, 93)
+
         # 画水
-        painter.setPen(QtGui.QPen(QtGui.QColor('#d0ffff')))
-        painter.setBrush(QtGui.QBrush(QtGui.QColor('#d0ffff')))
-        height = int(self.waterPercent * (60-2))
-        y = 75-1-height
-        painter.drawRect(6, y, 68, height)
+        painter.setPen(PEN_WATER)
+        painter.setBrush(BRUSH_WATER)
+        painter.drawRect(6, self.waterY, 68, self.waterHeight)
 
         # 显示百分比数字
-        painter.setPen(QtGui.QPen(QtGui.QColor('black')))
-        percent = f'{self.waterPercent*100:.1f}%'
-        painter.drawText(20, 50, percent)
+        painter.setPen(PEN_TEXT)
+        painter.drawText(20, 50, self.percentText)
 
 
     # 设定控件显示区域大小
@@ -150,7 +232,96 @@ class WaterTankItem(Item, QtWidgets.QGraphicsItem):
 
 
 
+class PumpAnimator:
+    '''
+    风泵动画时钟
+
+    所有转动的风泵共用一个定时器，帧率由 gstore.pumpAnimationFps 限制，
+    每帧按实际经过的时间转动角度，帧率降低时转速不变。
+    不在任何 view 可见区域内的风泵不转动也不重绘，
+    可见的风泵用 scene 的索引查出来，每帧的开销和可见的 item 数有关，和风泵总数无关
+    '''
+    def __init__(self):
+        # 第一次有风泵转动时才创建定时器，这时 QApplication 已经存在
+        self.timer = None
+        # 风泵item : 每秒转动的角度
+        self.pumps = {}
+        # 有风泵转动的 scene
+        self.scenes = set()
+        self.lastTick = 0.0
+
+        # 统计
+        self.frames = 0
+        self.lastVisible = 0
+
+    def setSpeed(self, pump, degreesPerSec):
+        if degreesPerSec:
+            self.pumps[pump] = degreesPerSec
+            if pump.scene() is not None:
+                self.scenes.add(pump.scene())
+        else:
+            self.pumps.pop(pump, None)
+
+        if not self.pumps:
+            self.scenes.clear()
+            if self.timer is not None:
+                self.timer.stop()
+            return
+
+        if self.timer is None:
+            self.timer = QTimer()
+            self.timer.timeout.connect(self.tick)
+        if not self.timer.isActive():
+            self.lastTick = time.perf_counter()
+            self.timer.start(max(1, round(1000 / gstore.pumpAnimationFps)))
+
+    def remove(self, pump):
+        self.setSpeed(pump, 0)
+
+    def clear(self):
+        self.pumps.clear()
+        self.scenes.clear()
+        if self.timer is not None:
+            self.timer.stop()
+
+    def tick(self):
+        now = time.perf_counter()
+        elapsed = now - self.lastTick
+        self.lastTick = now
+
+        pumps = self.pumps
+        # 多个 view 显示同一个风泵时只转一次
+        rotated = set()
+
+        for scene in self.scenes:
+            for view in scene.views():
+                # 缩小显示时风泵画成色块，不用转动
+                if (not view.isVisible() or view.window().isMinimized()
+                        or view.transform().m11() < gstore.lodScale):
+                    continue
+
+                rect = view.mapToScene(view.viewport().rect()).boundingRect()
+                for item in scene.items(rect, Qt.IntersectsItemBoundingRect):
+                    speed = pumps.get(item)
+                    if speed is None or item in rotated:
+                        continue
+                    # 不可见期间的角度不用补，风扇转到哪里看不出来
+                    item.rotate(speed * elapsed)
+                    rotated.add(item)
+
+        visible = len(rotated)
+
+        self.frames += 1
+        self.lastVisible = visible
+
+
+pumpAnimator = PumpAnimator()
+
+
 class WindPumpItem(Item, QtWidgets.QGraphicsItem):
+    # 按钮 : 风扇每秒转动的角度
+    BTN_SPEEDS = {1: 100, 2: 286, 3: 667}
+
     def __init__(self):
         super().__init__()
 
@@ -163,8 +334,9 @@ class WindPumpItem(Item, QtWidgets.QGraphicsItem):
         self.selectedBtn = None
 
         self.startAngle = 360
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.timerEvent)
+
+        # 底座、风箱体、喷嘴
+        self.body = StaticBodyItem(self, self.boundingRect(), self.paintBody)
 
 
         self.props = {
@@ -181,6 +353,9 @@ class WindPumpItem(Item, QtWidgets.QGraphicsItem):
 
         self.setPos(*data["pos"])
 
+    def handleNotify(self, msg):
+        # 风扇转速由界面上的按钮控制，设备消息不改变显示
+        pass
 
     def itemPropChanged(self,cfgName,newValue:str):
         oldValue = self.props[cfgName]
@@ -203,81 +378,60 @@ class WindPumpItem(Item, QtWidgets.QGraphicsItem):
         else :
             return
 
-    def timerEvent(self):
-        self.startAngle -= 20
-        if self.startAngle < 0:
-            self.startAngle += 360
+    def rotate(self, degrees):
+        self.startAngle = (self.startAngle - degrees) % 360
         self.update()
 
-    # 设定控件显示内容
-    def paint(self, painter, option, widget):
-
-        # 画笔
-        painter.setPen(QtGui.QPen(QtGui.QColor('#4c8bbe'), 1))
-        painter.setBrush(QtGui.QBrush(QtGui.QColor('#fff')))
-
-        # 选中状态，画选中方框
-        if self.isSelected():
-            painter.drawRect(1, 1, 88, 98)
-
-        # 圆心坐标
-        cx, cy = 40, 40
-        # 圆半径
-        r = 35
+    @staticmethod
+    def paintBody(painter):
+        # 圆心坐标 (40, 40)， 圆半径 35
+        painter.setPen(PEN_PUMP)
+        painter.setBrush(BRUSH_WHITE)
 
         # 底座
-        painter.drawPolygon(
-            [
-                QPoint(cx-30,cy+20),
-                QPoint(cx-39,cy+55 ),
-                QPoint(cx+39,cy+55 ),
-                QPoint(cx+30,cy+20),
-            ]
-        )
+        painter.drawPolygon(PUMP_BASE)
 
         # 风箱体
-        painter.drawEllipse(QPoint(cx, cy), r, r)
+        painter.drawEllipse(5, 5, 70, 70)
         # 喷嘴
-        painter.drawRect(cx, cy-r, r+10, r-10)
+        painter.drawRect(40, 5, 45, 25)
         # 遮挡多余线条
-        painter.setPen(QtGui.QPen(QtGui.QColor('white'), 2))
-        painter.drawLine(cx, cy-r+2, cx, cy-10)
-        painter.drawLine(cx, cy-10, cx+r-3, cy-10)
+        painter.setPen(PEN_MASK)
+        painter.drawLine(40, 7, 40, 30)
+        painter.drawLine(40, 30, 72, 30)
 
-        # 风扇
-        painter.setPen(QtGui.QPen(QtGui.QColor('gray'), 1))
-        painter.drawPie(cx-25,cy-25, 50, 50, self.startAngle*16, 50*16)
-        painter.drawPie(cx-25,cy-25, 50, 50, (self.startAngle+120)*16, 50*16)
-        painter.drawPie(cx-25,cy-25, 50, 50, (self.startAngle+240)*16, 50*16)
-
-        # 控制按钮
-        btn1x, btn2x, btn3x = 10, 35, 60
-        btnY = cy + r + 4
-        width = 12
+    # 设定控件显示内容，不变的部分由 self.body 画
+    def paint(self, painter, option, widget):
+        if isLowDetail(option, painter):
+            painter.fillRect(5, 5, 70, 90, COLOR_WATER_GLYPH if self.selectedBtn else COLOR_PUMP_GLYPH)
+            return
 
-        colorWhite = QtGui.QColor('white')
-        colorBlue  = QtGui.QColor('#6DCDDC')
+        # 选中状态，画选中方框
+        if self.isSelected():
+            painter.setPen(PEN_PUMP)
+            painter.setBrush(BRUSH_NONE)
+            painter.drawRect(1, 1, 88, 98)
 
-        painter.setPen(QtGui.QPen(QtGui.QColor('#4c8bbe'), 1))
+        # 风扇
+        painter.setPen(PEN_FAN)
+        painter.setBrush(BRUSH_WHITE)
+        angle = int(self.startAngle*16)
+        painter.drawPie(15, 15, 50, 50, angle, 50*16)
+        painter.drawPie(15, 15, 50, 50, angle + 120*16, 50*16)
+        painter.drawPie(15, 15, 50, 50, angle + 240*16, 50*16)
 
-        if self.selectedBtn == 1:
-            painter.setBrush(QtGui.QBrush(colorBlue))
-        else:
-            painter.setBrush(QtGui.QBrush(colorWhite))
-        painter.drawRect(btn1x, btnY, width, width)
+        # 控制按钮，按钮y坐标 cy + r + 4， 宽度 12
+        painter.setPen(PEN_PUMP)
+        selectedBtn = self.selectedBtn
 
+        painter.setBrush(BRUSH_BTN_ON if selectedBtn == 1 else BRUSH_WHITE)
+        painter.drawRect(10, 79, 12, 12)
 
-        if self.selectedBtn == 2:
-            painter.setBrush(QtGui.QBrush(colorBlue))
-        else:
-            painter.setBrush(QtGui.QBrush(colorWhite))
-        painter.drawRect(btn2x, btnY, width, width)
+        painter.setBrush(BRUSH_BTN_ON if selectedBtn == 2 else BRUSH_WHITE)
+        painter.drawRect(35, 79, 12, 12)
 
-        if self.selectedBtn == 3:
-            painter.setBrush(QtGui.QBrush(colorBlue))
-        else:
-            painter.setBrush(QtGui.QBrush(colorWhite))
-        painter.drawRect(btn3x, btnY, width, width)
+        painter.setBrush(BRUSH_BTN_ON if selectedBtn == 3 else BRUSH_WHITE)
+        painter.drawRect(60, 79, 12, 12)
 
     def mouseDoubleClickEvent(self, e):
         # print(e.pos())
@@ -288,40 +442,28 @@ class WindPumpItem(Item, QtWidgets.QGraphicsItem):
             return
 
         if self.btn1_x_range[0] <= x <= self.btn1_x_range[1]:
-            if self.selectedBtn == 1: # 已经选中，双击停止
-                self.selectedBtn = None
-                self.timer.stop()
-            else:
-                self.selectedBtn = 1
-                self.timer.stop()
-                self.timer.start(200)
+            btn = 1
         elif self.btn2_x_range[0] <= x <= self.btn2_x_range[1]:
-            if self.selectedBtn == 2: # 已经选中，双击停止
-                self.selectedBtn = None
-                self.timer.stop()
-            else:
-                self.selectedBtn = 2
-                self.timer.stop()
-                self.timer.start(70)
+            btn = 2
         elif self.btn3_x_range[0] <= x <= self.btn3_x_range[1]:
-            if self.selectedBtn == 3: # 已经选中，双击停止
-                self.selectedBtn = None
-                self.timer.stop()
-            else:
-                self.selectedBtn = 3
-                self.timer.stop()
-                self.timer.start(30)
+            btn = 3
         else:
             return
 
+        # 已经选中，双击停止
+        self.selectedBtn = None if self.selectedBtn == btn else btn
+        pumpAnimator.setSpeed(self, self.BTN_SPEEDS.get(self.selectedBtn, 0))
+
         self.update()
 
         fanSpeed = self.selectedBtn if self.selectedBtn else 0
-        connector.sendMsg('device_control', {
+        ok = connector.sendMsg('device_control', {
             "device-sn" : self.props['设备编号'],
             "operation" : "set-wind-pump-speed",
             "fan-speed" : fanSpeed
         })
+        if not ok:
+            window.statusBar().showMessage('控制命令未发送 : 网关未连接或发送队列已满', 3000)
 
     # 设定控件显示区域大小
     def boundingRect(self):
@@ -331,6 +473,85 @@ class WindPumpItem(Item, QtWidgets.QGraphicsItem):
 
 
 
+class IconItem(QtWidgets.QGraphicsPixmapItem):
+    '''设备图标，缩小显示时画成图标平均颜色的色块'''
+    def __init__(self, pic, width):
+        super().__init__(iconCache.get(pic, width))
+        self.glyphColor = iconCache.color(pic)
+
+    def paint(self, painter, option, widget):
+        if isLowDetail(option, painter):
+            painter.fillRect(self.boundingRect(), self.glyphColor)
+            return
+        super().paint(painter, option, widget)
+
+
+class ValueLabelItem(QtWidgets.QGraphicsItem):
+    '''
+    设备文字
+
+    代替 QGraphicsTextItem，不用每次更新都重建、重新排版 QTextDocument。
+    文字没变化时直接返回，排版结果由 QStaticText 缓存，缩小显示时不画
+    '''
+    # 和 QGraphicsTextItem 的文档边距一样，保持原来的显示位置
+    MARGIN = 4
+
+    def __init__(self):
+        super().__init__()
+        self.text = ''
+        self.staticText = QtGui.QStaticText()
+        self.staticText.setTextFormat(Qt.PlainText)
+        self.staticText.setPerformanceHint(QtGui.QStaticText.AggressiveCaching)
+        self.font = QtGui.QFont()
+        self.pen = PEN_TEXT
+        self.textWidth = -1.0
+        self.rect = QRectF()
+
+    def setDefaultTextColor(self, color):
+        self.pen = QtGui.QPen(color)
+        self.update()
+
+    def setFont(self, font):
+        self.font = font
+        self.staticText.prepare(font=font)
+        self.updateGeometry()
+
+    def setTextWidth(self, width):
+        self.textWidth = width
+        self.staticText.setTextWidth(width - 2*self.MARGIN if width > 0 else -1)
+        self.updateGeometry()
+
+    def setPlainText(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        # QStaticText 纯文本用 Unicode 行分隔符换行
+        self.staticText.setText(text.replace('\n', '\u2028'))
+        self.updateGeometry()
+
+    def toPlainText(self):
+        return self.text
+
+    def updateGeometry(self):
+        size = self.staticText.size()
+        width = self.textWidth if self.textWidth > 0 else size.width() + 2*self.MARGIN
+        rect = QRectF(0, 0, width, size.height() + 2*self.MARGIN)
+        if rect != self.rect:
+            self.prepareGeometryChange()
+            self.rect = rect
+        self.update()
+
+    def boundingRect(self):
+        return self.rect
+
+    def paint(self, painter, option, widget):
+        if isLowDetail(option, painter):
+            return
+        painter.setFont(self.font)
+        painter.setPen(self.pen)
+        painter.drawStaticText(self.MARGIN, self.MARGIN, self.staticText)
+
+
 class PictureItem(Item, QtWidgets.QGraphicsItemGroup):
     def __init__(self, pic=None, text=None):
         super().__init__()
@@ -344,21 +565,15 @@ class PictureItem(Item, QtWidgets.QGraphicsItemGroup):
             'zValue' : '0.0',
         }
 
-        self.dso = DeviceSignalObject()
-        self.dso.mdata_change.connect(self.handleNotify)
-
         # 从文件加载
         if pic is None:
             return
 
         self.pic = pic
-        self.oriPixmap = QtGui.QPixmap(f'./images/{pic}.png')
-        pixmap = self.oriPixmap.scaledToWidth(40, Qt.SmoothTransformation)
-
-        self.picItem = QtWidgets.QGraphicsPixmapItem(pixmap)
+        self.picItem = IconItem(pic, 40)
         self.picItem.setPos(0, 0)  # 设置其在parent的显示位置
 
-        self.textItem = QtWidgets.QGraphicsTextItem()
+        self.textItem = ValueLabelItem()
         self.textItem.setDefaultTextColor(QtGui.QColor('#3687b8'))
         self.textItem.setFont(QtGui.QFont('微软雅黑', pointSize=9))
         self.textItem.setTextWidth(70)
@@ -369,9 +584,15 @@ class PictureItem(Item, QtWidgets.QGraphicsItemGroup):
         self.addToGroup(self.picItem)
         self.addToGroup(self.textItem)
 
-    def handleNotify(self):
+    def handleNotify(self, msg):
         pass
 
+    def mouseDoubleClickEvent(self, e):
+        # 有设备编号的，双击显示读数趋势
+        deviceSn = self.props.get('设备编号')
+        if deviceSn:
+            window.showTrend(deviceSn)
+
     def loadData(self,data):
         # 设置props
         self.props = data["props"]
@@ -380,13 +601,10 @@ class PictureItem(Item, QtWidgets.QGraphicsItemGroup):
 
         # 其他设置
         self.pic = data["pic"]
-        self.oriPixmap = QtGui.QPixmap(f'./images/{self.pic}.png')
-        pixmap = self.oriPixmap.scaledToWidth(int(props['图标宽度']), Qt.SmoothTransformation)
-
-        self.picItem = QtWidgets.QGraphicsPixmapItem(pixmap)
+        self.picItem = IconItem(self.pic, int(props['图标宽度']))
         self.picItem.setPos(*[int(p) for p in props['图标位置'].split(',')])
 
-        self.textItem = QtWidgets.QGraphicsTextItem()
+        self.textItem = ValueLabelItem()
         self.textItem.setDefaultTextColor(QtGui.QColor('#3687b8'))
         self.textItem.setFont(QtGui.QFont('微软雅黑', pointSize=9))
         self.textItem.setTextWidth(float(props['文字宽度']))
@@ -415,7 +633,7 @@ class PictureItem(Item, QtWidgets.QGraphicsItemGroup):
             self.addToGroup(self.picItem)
 
         elif cfgName == '图标宽度':
-            pixmap = self.oriPixmap.scaledToWidth(int(newValue), Qt.SmoothTransformation)
+            pixmap = iconCache.get(self.pic, int(newValue))
             self.picItem.setPixmap(pixmap)
 
             self.removeFromGroup(self.picItem)
@@ -473,13 +691,10 @@ class PictureItem_GasMeter(PictureItem):
 
         self.props['设备编号'] = ''
 
-    def handleNotify(self, msg):
-        txt = f'''CO : {msg['CO']}
-SO2 : {msg['SO2']}
-HCL : {msg['HCl']}
-        '''
+    LABEL = 'CO : {}\nSO2 : {}\nHCL : {}'.format
 
-        self.textItem.setPlainText(txt)
+    def handleNotify(self, msg):
+        self.textItem.setPlainText(self.LABEL(msg['CO'], msg['SO2'], msg['HCl']))
 
 
 class PictureItem_TempMeter(PictureItem):
@@ -489,12 +704,10 @@ class PictureItem_TempMeter(PictureItem):
         self.props['设备编号'] = ''
 
 
-    def handleNotify(self, msg):
-        txt = f'''温度 : {msg['temperature']}
-湿度 : {msg['humidity']}
-        '''
+    LABEL = '温度 : {}\n湿度 : {}'.format
 
-        self.textItem.setPlainText(txt)
+    def handleNotify(self, msg):
+        self.textItem.setPlainText(self.LABEL(msg['temperature'], msg['humidity']))
 
 class PictureItem_WindMeter(PictureItem):
     def __init__(self, pic=None, text=None):
@@ -502,11 +715,10 @@ class PictureItem_WindMeter(PictureItem):
 
         self.props['设备编号'] = ''
 
-    def handleNotify(self, msg):
-        txt = f'''风速 : {msg['flow-rate']}
-        '''
+    LABEL = '风速 : {}'.format
 
-        self.textItem.setPlainText(txt)
+    def handleNotify(self, msg):
+        self.textItem.setPlainText(self.LABEL(msg['flow-rate']))
 
 class PictureItem_WaterMeter(PictureItem):
     def __init__(self, pic=None, text=None):
@@ -514,12 +726,10 @@ class PictureItem_WaterMeter(PictureItem):
 
         self.props['设备编号'] = ''
 
-    def handleNotify(self, msg):
-        txt = f'''流速 : {msg['flow-rate']}
-水压 : {msg['water-pressure']}
-        '''
+    LABEL = '流速 : {}\n水压 : {}'.format
 
-        self.textItem.setPlainText(txt)
+    def handleNotify(self, msg):
+        self.textItem.setPlainText(self.LABEL(msg['flow-rate'], msg['water-pressure']))
 
 class PictureItem_WaterTank(PictureItem):
     def __init__(self, pic=None, text=None):
@@ -527,9 +737,10 @@ class PictureItem_WaterTank(PictureItem):
 
         self.props['设备编号'] = ''
 
+    LABEL = '水量 : {:.1f}%'.format
+
     def handleNotify(self, msg):
-        txt = f'''水量 : {msg['water-amount']*100:.1f}%'''
-        self.textItem.setPlainText(txt)
+        self.textItem.setPlainText(self.LABEL(msg['water-amount']*100))
 
 
 class PictureItem_Camera(PictureItem):
@@ -811,6 +1022,177 @@ class TextItem(Item, QtWidgets.QGraphicsTextItem):
 
 
 
+# 元件图中 type 字段可以使用的 item 类型
+ITEM_TYPES = {cls.__name__: cls for cls in (
+    WaterTankItem,
+    WindPumpItem,
+    PictureItem,
+    PictureItem_GasMeter,
+    PictureItem_TempMeter,
+    PictureItem_WindMeter,
+    PictureItem_WaterMeter,
+    PictureItem_WaterTank,
+    PictureItem_Camera,
+    RectItem,
+    EllipseItem,
+    LineItem,
+    TextItem,
+)}
+
+
+def validateItemData(itemData):
+    '''检查元件图中一项的格式，返回错误信息，没有错误返回 None'''
+    if not isinstance(itemData, dict):
+        return '不是对象'
+
+    typeName = itemData.get('type')
+    theClass = ITEM_TYPES.get(typeName)
+    if theClass is None:
+        return f'未知类型 {typeName}'
+
+    pos = itemData.get('pos')
+    if not (isinstance(pos, list) and len(pos) == 2
+            and all(type(p) in (int, float) for p in pos)):
+        return f'pos 格式错误 {pos}'
+
+    if not isinstance(itemData.get('props'), dict):
+        return 'props 格式错误'
+
+    if issubclass(theClass, PictureItem) and not isinstance(itemData.get('pic'), str):
+        return '缺少 pic'
+
+    return None
+
+
+def parseLayout(data):
+    '''
+    校验元件图，不创建 item，可以在工作线程里调用
+
+    data : LayoutStore.read() 返回的 item 列表，从上到下的顺序
+
+    返回 ([(叠放序号, itemData)], [错误信息])，有设备编号的 item 排在前面，
+    加载时先创建，实时数据可以尽早显示
+    '''
+    # 保存时 scene.items() 是从上到下的顺序，反过来就是从下到上的叠放顺序
+    data = data[::-1]
+
+    devices, others, errors = [], [], []
+    for index, itemData in enumerate(data):
+        error = validateItemData(itemData)
+        if error:
+            errors.append(f'第 {len(data) - index} 项 : {error}')
+            continue
+
+        if itemData['props'].get('设备编号'):
+            devices.append((index, itemData))
+        else:
+            others.append((index, itemData))
+
+    return devices + others, errors
+
+
+def restoreStacking(ordered):
+    '''
+    设备 item 先加载，会被后加载的装饰 item 盖住，这里恢复原来的叠放顺序
+
+    ordered : 按原来叠放顺序(从下到上)排列的 [(item, 是否设备)]
+    zValue 相同时后加入 scene 的在上面，把每个装饰 item 移到原来在它上面、
+    zValue 相同的第一个设备 item 的下面
+    '''
+    targets = []
+    above = {}
+    for item, isDevice in reversed(ordered):
+        if isDevice:
+            above[item.zValue()] = item
+        else:
+            targets.append((item, above.get(item.zValue())))
+
+    # 从下往上移动，同一个设备下面的多个装饰 item 保持原来的顺序
+    for item, device in reversed(targets):
+        if device is not None:
+            item.stackBefore(device)
+
+
+class LayoutLoader(QObject):
+    '''
+    分步加载元件图
+
+    工作线程读取、解析、校验，界面线程定时分批创建 item，
+    每批不超过 gstore.loadSliceMs 毫秒，加载过程中界面可以正常操作
+    '''
+    parsed = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, window, read, name, synced):
+        super().__init__(window)
+        self.window = window
+        # 在工作线程里调用，返回 item 列表
+        self.read = read
+        self.name = name
+        # 加载后画布和文件内容是否一致，一致时可以增量保存，None 表示不改变
+        self.synced = synced
+
+        self.pending = []
+        self.errors = []
+        self.loaded = []  # [(叠放序号, item, 是否设备)]
+        self.total = 0
+        self.startTime = 0.0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.loadSlice)
+
+        self.parsed.connect(self.onParsed)
+        self.failed.connect(self.onFailed)
+
+    def start(self):
+        self.startTime = time.perf_counter()
+        thread = threading.Thread(target=self.parse, daemon=True)
+        thread.start()
+
+    def parse(self):
+        try:
+            result = parseLayout(self.read())
+        except Exception as e:
+            self.failed.emit(repr(e))
+            return
+        self.parsed.emit(result)
+
+    def onParsed(self, result):
+        self.pending, self.errors = result
+        self.total = len(self.pending)
+        # 倒序存放，每次从尾部取
+        self.pending.reverse()
+        self.window.loadStarted(self.total)
+        self.timer.start(0)
+
+    def onFailed(self, error):
+        self.window.loadFinished(f'加载 {self.name} 失败 : {error}', None)
+
+    def loadSlice(self):
+        deadline = time.perf_counter() + gstore.loadSliceMs / 1000
+        pending = self.pending
+        while pending and time.perf_counter() < deadline:
+            index, itemData = pending.pop()
+            item = self.window.addLoadedItem(itemData)
+            self.loaded.append((index, item, bool(itemData['props'].get('设备编号'))))
+
+        self.window.loadProgress(self.total - len(pending))
+        if pending:
+            return
+
+        self.timer.stop()
+        self.loaded.sort(key=lambda x: x[0])
+        restoreStacking([(item, isDevice) for _, item, isDevice in self.loaded])
+
+        cost = time.perf_counter() - self.startTime
+        message = f'已加载 {self.total} 项，用时 {cost:.1f} 秒'
+        if self.errors:
+            message += f'，跳过 {len(self.errors)} 项格式错误'
+            for error in self.errors:
+                print(error)
+        self.window.loadFinished(message, self.synced)
+
+
 class DragLabel(QtWidgets.QLabel):
 
     def mouseMoveEvent(self, e):
@@ -834,6 +1216,82 @@ class DnDGraphicView(QtWidgets.QGraphicsView):
     def __init__(self, *args):
         super().__init__(*args)
         self.lastDropItem = None
+        # 中键拖动平移时，上一次的鼠标位置
+        self.panPos = None
+
+        # 滚轮缩放时，鼠标下的位置保持不动
+        self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
+        # 元件图从左上角开始排列
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.setCacheMode(QtWidgets.QGraphicsView.CacheBackground)
+
+    def zoomBy(self, factor):
+        scale = self.transform().m11()
+        target = min(max(scale * factor, gstore.zoomMin), gstore.zoomMax)
+        if target != scale:
+            self.scale(target / scale, target / scale)
+            self.exposed()
+
+    def fitAll(self):
+        rect = self.scene().itemsBoundingRect()
+        if not rect.isEmpty():
+            self.fitInView(rect, Qt.KeepAspectRatio)
+            self.exposed()
+
+    def exposed(self):
+        # 可见区域变化，让 RenderScheduler 更新新露出来的 item
+        gstore.main_window.renderScheduler.markExposed()
+        # 按区域加载时，加载新露出来的区域
+        gstore.main_window.regionExposed()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.exposed()
+
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        self.exposed()
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        self.exposed()
+
+    def wheelEvent(self, e):
+        # 按住 Ctrl 滚轮缩放，否则滚动
+        if not e.modifiers() & Qt.ControlModifier:
+            super().wheelEvent(e)
+            return
+        self.zoomBy(1.25 ** (e.angleDelta().y() / 120))
+
+    def mousePressEvent(self, e):
+        # 中键拖动平移画布，编辑、查看模式都可以用
+        if e.button() == Qt.MiddleButton:
+            self.panPos = e.position()
+            self.viewport().setCursor(Qt.ClosedHandCursor)
+            return
+        super().mousePressEvent(e)
+
+    def mouseMoveEvent(self, e):
+        if self.panPos is not None:
+            delta = e.position() - self.panPos
+            self.panPos = e.position()
+            hbar, vbar = self.horizontalScrollBar(), self.verticalScrollBar()
+            hbar.setValue(hbar.value() - round(delta.x()))
+            vbar.setValue(vbar.value() - round(delta.y()))
+            return
+        super().mouseMoveEvent(e)
+
+    def mouseReleaseEvent(self, e):
+        if e.button() == Qt.MiddleButton and self.panPos is not None:
+            self.panPos = None
+            self.viewport().unsetCursor()
+            return
+        super().mouseReleaseEvent(e)
+
+    def paintEvent(self, e):
+        super().paintEvent(e)
+        # 统计设备数据从网关发出到显示出来的延迟
+        gstore.main_window.renderScheduler.painted()
 
     def dragMoveEvent(self, e):
         pass
@@ -891,8 +1349,8 @@ class DnDGraphicView(QtWidgets.QGraphicsView):
 
         self.scene().addItem(item)
 
-        # 设置一些属性
-        item.setPos(e.position())
+        # 设置一些属性，画布可能缩放、滚动过，转换为 scene 坐标
+        item.setPos(self.mapToScene(e.position().toPoint()))
 
         # 设置item可以移动
         item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, True)
@@ -900,6 +1358,11 @@ class DnDGraphicView(QtWidgets.QGraphicsView):
         item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable, True)
         # 设置item可以聚焦，这样才会有键盘按键回调keyPressEvent
         item.setFlag(QtWidgets.QGraphicsItem.ItemIsFocusable, True)
+        # 移动时回调 itemChange，记录到编辑日志
+        item.setFlag(QtWidgets.QGraphicsItem.ItemSendsGeometryChanges, True)
+
+        item.uid = newUid()
+        window.markEdited(item, 'add')
 
         # 设置为选中
         if self.lastDropItem:
@@ -910,12 +1373,268 @@ class DnDGraphicView(QtWidgets.QGraphicsView):
         item.setSelected(True)
         self.lastDropItem = item
 
-    # 该方法使得view 改变大小时（比如拖拽主窗口resize）， scene大小跟着变化
-    # 否则，view和secen大小不一致， 拖放item 时，位置就不对了。
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        size = event.size()
-        self.setSceneRect(0, 0, size.width(), size.height())
+
+class RenderScheduler:
+    '''
+    设备刷新调度
+
+    每个刷新周期取走所有合并后的设备通知，一次性更新到各个item，
+    收集这些item的区域，只触发一次 viewport 重绘
+
+    不在可见区域内(或窗口最小化)的设备只记下最新消息，
+    滚动、缩放、窗口恢复后再更新新露出来的item
+    '''
+    def __init__(self, window):
+        self.window = window
+
+        # 延后更新的 item : 最新消息
+        self.deferred = {}
+        # 按区域加载时还没加载的设备 : 最新消息
+        self.unloaded = {}
+        # 可见区域变化过，下次刷新时检查延后的 item
+        self.exposePending = False
+
+        self.timer = QTimer(window)
+        self.timer.timeout.connect(self.tick)
+
+        # 统计
+        self.batchCount = 0
+        self.lastBatchSize = 0
+        self.lastBatchTime = 0.0  # 毫秒
+        self.maxBatchTime = 0.0
+        self.totalBatchTime = 0.0
+        self.failures = 0  # 更新 item 出错的次数
+
+        # 已更新到item、还没重绘的消息的网关发送时间
+        self.appliedTs = deque(maxlen=10000)
+        # 最近消息从网关发出到重绘完成的延迟，秒
+        self.wireToPaint = deque(maxlen=10000)
+
+    def start(self, interval):
+        self.timer.start(interval)
+
+    def markExposed(self):
+        self.exposePending = True
+
+    def forget(self, item):
+        self.deferred.pop(item, None)
+
+    def visibleSceneRect(self):
+        view = self.window.view
+        if self.window.isMinimized() or not view.isVisible():
+            return None
+        return view.mapToScene(view.viewport().rect()).boundingRect()
+
+    def tick(self):
+        pending = coalescer.drain()
+        if not pending and not (self.exposePending and self.deferred):
+            return
+
+        t0 = time.perf_counter()
+
+        view = self.window.view
+        visibleRect = self.visibleSceneRect()
+        dirtyRegion = QtGui.QRegion()
+        delivered = dropped = 0
+
+        # 新露出来的 item，补上延后的更新
+        if self.exposePending and visibleRect is not None:
+            self.exposePending = False
+            if self.deferred:
+                for item in self.window.scene.items(visibleRect, Qt.IntersectsItemBoundingRect):
+                    msg = self.deferred.pop(item, None)
+                    if msg is None:
+                        continue
+                    if not self.apply(item.handleNotify, msg):
+                        dropped += 1
+                        continue
+                    delivered += 1
+                    rect = view.mapFromScene(item.sceneBoundingRect()).boundingRect()
+                    dirtyRegion += rect.adjusted(-1, -1, 1, 1)
+
+        for deviceSn, msg in pending.items():
+            if deviceSn == 'stats':
+                if self.apply(self.window.handle_stats, msg):
+                    delivered += 1
+                else:
+                    dropped += 1
+                continue
+
+            item = gstore.deviceSn_to_item.get(deviceSn)
+            if item is None:
+                # 登记了但还没加载的设备，加载后补上
+                if deviceSn in gstore.deviceSn_to_item:
+                    self.unloaded[deviceSn] = msg
+                # 消息在队列里时，设备可能已被删除
+                else:
+                    dropped += 1
+                continue
+
+            bounds = item.sceneBoundingRect()
+            if visibleRect is None or not visibleRect.intersects(bounds):
+                self.deferred[item] = msg
+                continue
+
+            self.deferred.pop(item, None)
+            if not self.apply(item.handleNotify, msg):
+                dropped += 1
+                continue
+            delivered += 1
+
+            # 网关带了发送时间的，记下来，重绘后计算延迟
+            ts = msg.get('ts')
+            if ts is not None:
+                self.appliedTs.append(ts)
+
+            # 映射到 view 坐标，多留1像素给抗锯齿
+            rect = view.mapFromScene(bounds).boundingRect()
+            dirtyRegion += rect.adjusted(-1, -1, 1, 1)
+
+        if not dirtyRegion.isEmpty():
+            view.viewport().update(dirtyRegion)
+
+        coalescer.delivered += delivered
+        coalescer.dropped += dropped
+
+        cost = (time.perf_counter() - t0) * 1000
+        self.batchCount += 1
+        self.lastBatchSize = delivered
+        self.lastBatchTime = cost
+        self.totalBatchTime += cost
+        if cost > self.maxBatchTime:
+            self.maxBatchTime = cost
+
+    def apply(self, handler, msg):
+        # 一个 item 出错(消息缺字段等)不影响同一批的其它 item
+        try:
+            handler(msg)
+        except Exception:
+            print(traceback.format_exc())
+            self.failures += 1
+            return False
+        return True
+
+    def painted(self):
+        if not self.appliedTs:
+            return
+        now = time.time()
+        self.wireToPaint.extend(now - ts for ts in self.appliedTs)
+        self.appliedTs.clear()
+
+    def snapshot(self):
+        return {
+            'batches'  : self.batchCount,
+            'lastSize' : self.lastBatchSize,
+            'lastTime' : self.lastBatchTime,
+            'maxTime'  : self.maxBatchTime,
+            'avgTime'  : self.totalBatchTime / self.batchCount if self.batchCount else 0,
+            'deferred' : len(self.deferred),
+            'failures' : self.failures,
+        }
+
+
+class TrendDialog(QtWidgets.QDialog):
+    '''
+    设备读数趋势
+
+    "最近" 显示内存中的读数历史，每秒刷新；
+    更长的时间范围从磁盘存储按像素分桶查询，画平均值曲线和 最小-最大 范围
+    '''
+    COLORS = ['#e6550d', '#3182bd', '#31a354', '#756bb1']
+    # 时间范围名称 : 秒数，None 表示内存中的历史
+    RANGES = {
+        '最近' : None,
+        '1小时' : 3600,
+        '1天' : 86400,
+        '1周' : 7 * 86400,
+        '4周' : 28 * 86400,
+    }
+
+    def __init__(self, deviceSn, parent):
+        super().__init__(parent)
+        self.deviceSn = deviceSn
+        self.setWindowTitle(f'{deviceSn} 读数趋势')
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.resize(640, 360)
+
+        layout = QtWidgets.QVBoxLayout(self)
+
+        self.rangeBox = QtWidgets.QComboBox()
+        self.rangeBox.addItems(list(self.RANGES))
+        # 没有开启磁盘存储时只能看内存中的历史
+        self.rangeBox.setEnabled(historyStore.root is not None)
+        self.rangeBox.currentTextChanged.connect(self.rangeChanged)
+        layout.addWidget(self.rangeBox)
+
+        self.pw = pg.PlotWidget(background='#fafafa', axisItems={'bottom': pg.DateAxisItem()})
+        self.pw.showGrid(True, True)
+        self.pw.addLegend()
+        layout.addWidget(self.pw)
+
+        # 字段名 : 平均值(或原始读数)曲线
+        self.curves = {}
+        # 字段名 : (最小值曲线, 最大值曲线)，之间填充颜色
+        self.bands = {}
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def rangeChanged(self, rangeName):
+        # 磁盘查询范围大，刷新慢一些
+        self.timer.start(1000 if self.RANGES[rangeName] is None else 10000)
+        self.refresh()
+
+    def curve(self, name):
+        curve = self.curves.get(name)
+        if curve is None:
+            color = QtGui.QColor(self.COLORS[len(self.curves) % len(self.COLORS)])
+            curve = self.curves[name] = self.pw.plot(
+                name=name, pen=pg.mkPen(color, width=1), connect='finite',
+                **STATS_CURVE_OPTIONS)
+
+            low, high = pg.PlotDataItem(connect='finite'), pg.PlotDataItem(connect='finite')
+            color.setAlpha(50)
+            fill = pg.FillBetweenItem(low, high, brush=pg.mkBrush(color))
+            self.pw.addItem(fill)
+            self.bands[name] = (low, high)
+        return curve
+
+    def refresh(self):
+        seconds = self.RANGES[self.rangeBox.currentText()]
+        if seconds is None:
+            self.refreshRecent()
+        else:
+            self.refreshStored(seconds)
+
+    def refreshRecent(self):
+        result = telemetry.query(self.deviceSn)
+        if result is None:
+            self.pw.setTitle('暂无数据', color='#798699')
+            return
+        self.pw.setTitle('')
+
+        t, fields = result
+        for name, values in fields.items():
+            self.curve(name).setData(t, values)
+            for band in self.bands[name]:
+                band.setData([], [])
+
+    def refreshStored(self, seconds):
+        end = time.time()
+        start = end - seconds
+        # 每个像素一个分桶
+        buckets = max(100, self.pw.width())
+
+        names = historyStore.fields(self.deviceSn, start, end)
+        self.pw.setTitle('' if names else '暂无数据', color='#798699')
+        for name in names:
+            t, mins, maxs, means = historyStore.query(self.deviceSn, name, start, end, buckets)
+            self.curve(name).setData(t, means)
+            low, high = self.bands[name]
+            low.setData(t, mins)
+            high.setData(t, maxs)
 
 
 class MWindow(QtWidgets.QMainWindow):
@@ -925,6 +1644,37 @@ class MWindow(QtWidgets.QMainWindow):
         self.resize(1800, 1000)
 
         gstore.main_window = self
+        # view 滚动、缩放时会通知它，要在创建 view 之前创建
+        self.renderScheduler = RenderScheduler(self)
+        # 设备编号 : 打开的趋势窗口
+        self.trendDialogs = {}
+        # 正在进行的分步加载
+        self.layoutLoader = None
+        # 开始加载时已有的改动 uid
+        self.editsBeforeLoad = None
+        # 回放抓包时，等元件图加载完成、设备都登记后才开始回放
+        self.pendingReplayer = None
+
+        # 设置了 layoutDbFile 时使用 SQLite 元件图，按可见区域加载
+        if gstore.layoutDbFile:
+            self.layoutStore = LayoutDB(gstore.layoutDbFile)
+        else:
+            self.layoutStore = LayoutStore('cfg.json')
+        # 已开始按区域加载
+        self.regionMode = False
+        # 区域加载进行中时可见区域又变了，完成后再加载一次
+        self.regionPending = False
+        # 滚动、缩放停下来后再查询，不在每次滚动时查询
+        self.regionTimer = QTimer(self)
+        self.regionTimer.setSingleShot(True)
+        self.regionTimer.setInterval(gstore.regionLoadDelay)
+        self.regionTimer.timeout.connect(self.loadRegion)
+        # 画布内容和 cfg.json 一致时，保存只追加改动到编辑日志
+        self.layoutSynced = False
+        # 上次保存后的改动  uid : [item, {'add', 'move', 'props', 'del'}]
+        self.edits = {}
+        # 上次保存后清空过画布
+        self.editsCleared = False
 
         self.brush_edit = QtGui.QBrush(QtGui.QColor(0xfaf3f3 ), bs=Qt.CrossPattern)
         self.brush_view   = QtGui.QBrush(QtGui.QColor(0xfafafa ), bs=Qt.SolidPattern)
@@ -959,8 +1709,10 @@ class MWindow(QtWidgets.QMainWindow):
 
         self.setupToolBar()
 
-        self.dso = DeviceSignalObject()
-        self.dso.mdata_change.connect(self.handle_stats)
+        # 定时处理接收线程合并后的设备通知，并统一重绘
+        self.renderScheduler.start(gstore.notifyDrainInterval)
+
+        self.setupStatusBar()
 
     def setupToolBar(self):
 
@@ -969,16 +1721,16 @@ class MWindow(QtWidgets.QMainWindow):
         self.addToolBar(toolbar)
 
         # 添加 工具栏 条目Action
-        actionSave = toolbar.addAction(qta.icon("ph.download-light",color='green'),"保存")
+        self.actionSave = actionSave = toolbar.addAction(qta.icon("ph.download-light",color='green'),"保存")
         actionSave.triggered.connect(self.save)
 
-        actionLoad = toolbar.addAction(qta.icon("ph.upload-light",color='green'),"加载")
+        self.actionLoad = actionLoad = toolbar.addAction(qta.icon("ph.upload-light",color='green'),"加载")
         actionLoad.triggered.connect(self.load)
 
-        actionDelItem = toolbar.addAction(qta.icon("ph.x-square-light",color='green'),"删除")
+        self.actionDelItem = actionDelItem = toolbar.addAction(qta.icon("ph.x-square-light",color='green'),"删除")
         actionDelItem.triggered.connect(self.delItem)
 
-        actionDelAllItem = toolbar.addAction(qta.icon("ph.trash-light",color='green'),"清空")
+        self.actionDelAllItem = actionDelAllItem = toolbar.addAction(qta.icon("ph.trash-light",color='green'),"清空")
         actionDelAllItem.triggered.connect(self.delAllItems)
 
         self.icon_view = qta.icon("ph.eye-light",color='green')
@@ -987,14 +1739,110 @@ class MWindow(QtWidgets.QMainWindow):
 
         self.actionSwitchMode = toolbar.addAction(self.icon_view,"操作模式切换")
         self.actionSwitchMode.triggered.connect(self.switchMode)
+
+        actionZoomIn = toolbar.addAction(qta.icon("ph.magnifying-glass-plus-light",color='green'),"放大")
+        actionZoomIn.triggered.connect(lambda: self.view.zoomBy(1.25))
+
+        actionZoomOut = toolbar.addAction(qta.icon("ph.magnifying-glass-minus-light",color='green'),"缩小")
+        actionZoomOut.triggered.connect(lambda: self.view.zoomBy(0.8))
+
+        actionFitAll = toolbar.addAction(qta.icon("ph.corners-out-light",color='green'),"显示全部")
+        actionFitAll.triggered.connect(self.view.fitAll)
+
+        actionLocate = toolbar.addAction(qta.icon("ph.crosshair-light",color='green'),"定位设备")
+        actionLocate.triggered.connect(self.locateDevice)
         # 当前操作模式
         self.mode = 'view'  # view or edit
 
+    def setupStatusBar(self):
+        # 元件图加载进度，加载时才显示
+        self.loadProgressBar = QtWidgets.QProgressBar()
+        self.loadProgressBar.setMaximumWidth(200)
+        self.loadProgressBar.setFormat('加载 %v/%m')
+        self.loadProgressBar.hide()
+        self.statusBar().addPermanentWidget(self.loadProgressBar)
+
+        self.connLabel = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.connLabel)
+
+        self.notifyLabel = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.notifyLabel)
+
+        self.ctrlLabel = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.ctrlLabel)
+
+        # 定时刷新网关连接状态
+        self.connStatusTimer = QTimer(self)
+        self.connStatusTimer.timeout.connect(self.refreshConnStatus)
+        self.connStatusTimer.start(1000)
+        self.refreshConnStatus()
+
+    def refreshConnStatus(self):
+        s = connectionSnapshot()
+        stateName = {
+            'idle'      : '未启动',
+            'connecting': '连接中',
+            'connected' : '已连接',
+            'waiting'   : '等待重连',
+            'stopped'   : '已停止',
+        }[s['state']]
+
+        parts = [f'网关 : {stateName}']
+        if 'gateways' in s:
+            parts.append(f'在线 {s["gateways"]}')
+        if s['state'] == 'connected':
+            uptime = int(s['uptime'])
+            parts.append(f'运行 {uptime//3600:02d}:{uptime%3600//60:02d}:{uptime%60:02d}')
+        elif s['nextRetryIn'] is not None:
+            parts.append(f'{s["nextRetryIn"]:.1f}秒后重连')
+        parts.append(f'尝试 {s["attempts"]} 次')
+        if s['lastReconnectTime'] is not None:
+            parts.append(f'重连耗时 {s["lastReconnectTime"]:.1f}秒')
+        if s['lastError']:
+            parts.append(f'最近错误 : {s["lastError"]}')
+
+        w = sendSnapshot()
+        if w['sent'] or w['rejected']:
+            sendInfo = f'发送队列 {w["queued"]}/{w["maxQueue"]}'
+            if w['latencyP95'] is not None:
+                sendInfo += f' 延迟p95 {w["latencyP95"]*1000:.1f}ms'
+            if w['rejected']:
+                sendInfo += f' 拒绝 {w["rejected"]}'
+            parts.append(sendInfo)
+
+        self.connLabel.setText(' | '.join(parts))
+
+        t = connector.tracker.snapshot()
+        ctrlParts = []
+        slow = False
+        for op, st in t['operations'].items():
+            info = f'{op}'
+            if st['p50'] is not None:
+                info += f' p50/p95/p99 {st["p50"]*1000:.0f}/{st["p95"]*1000:.0f}/{st["p99"]*1000:.0f}ms'
+                slow = slow or st['p95'] > gstore.controlLatencyWarn
+            if st['timeouts']:
+                info += f' 超时 {st["timeouts"]}'
+                slow = True
+            ctrlParts.append(info)
+        if t['outstanding']:
+            ctrlParts.append(f'待确认 {t["outstanding"]}')
+        self.ctrlLabel.setText('控制 : ' + ' | '.join(ctrlParts) if ctrlParts else '')
+        # 控制延迟变差时标红提醒
+        self.ctrlLabel.setStyleSheet('color:#d03030;' if slow else '')
+
+        c = coalescer.snapshot()
+        r = self.renderScheduler.snapshot()
+        self.notifyLabel.setText(
+            f'通知 : 收到 {c["received"]} | 合并 {c["merged"]} | 丢弃 {c["dropped"]} | 处理 {c["delivered"]}'
+            f' | 刷新 {r["lastSize"]}项 {r["lastTime"]:.1f}ms (平均 {r["avgTime"]:.1f} 最大 {r["maxTime"]:.1f})'
+            f' | 不可见待更新 {r["deferred"]}')
+
     def switchMode(self):
         if self.mode == 'edit':
             self.mode = 'view'
             self.actionSwitchMode.setIcon(self.icon_view)
             self.view.setBackgroundBrush(self.brush_view)
+            self.view.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
 
             for item in self.scene.items():
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, False)
@@ -1003,34 +1851,215 @@ class MWindow(QtWidgets.QMainWindow):
             self.mode = 'edit'
             self.actionSwitchMode.setIcon(self.icon_edit)
             self.view.setBackgroundBrush(self.brush_edit)
+            self.view.setDragMode(QtWidgets.QGraphicsView.NoDrag)
 
             for item in self.scene.items():
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, True)
 
     def load(self):
-        with open('cfg.json', 'r', encoding='utf8') as f:
-            content = f.read()
+        # 上一次加载还没完成
+        if self.layoutLoader is not None:
+            return
 
-        data : list = json.loads(content)
-        data.reverse()
+        if isinstance(self.layoutStore, LayoutDB):
+            self.startRegionMode()
+            return
 
-        for itemData in data:
-            typeName = itemData["type"]
+        empty = not any(hasattr(item, 'toSaveData') for item in self.scene.items())
+        # 画布是空的，加载前的改动(删除、清空)都针对已不在画布上的 item，加载成功后丢弃，
+        # 加载过程中的改动保留
+        self.editsBeforeLoad = set(self.edits) if empty else None
+        self.startLoader(LayoutLoader(self, self.layoutStore.read, self.layoutStore.path, empty))
+
+    def startReplay(self, replayer):
+        """先加载元件图，加载完成后再回放，开头的消息不会因为设备还没登记被丢弃"""
+        self.pendingReplayer = replayer
+        self.load()
+        # 没有需要加载的内容
+        if self.layoutLoader is None:
+            self.startPendingReplay()
+
+    def startPendingReplay(self):
+        replayer, self.pendingReplayer = self.pendingReplayer, None
+        if replayer is not None:
+            print(f"replaying {replayer.path}")
+            replayer.start()
+
+    def startLoader(self, loader):
+        # 加载过程中 item 还没全部加入画布，不能保存、清空、删除、再次加载
+        self.layoutLoader = loader
+        for action in (self.actionSave, self.actionLoad, self.actionDelItem, self.actionDelAllItem):
+            action.setEnabled(False)
+        loader.start()
+
+    def checkNotLoading(self):
+        if self.layoutLoader is None:
+            return True
+        QtWidgets.QMessageBox.warning(
+            self,
+            '禁止',
+            '正在加载元件图，请等待加载完成')
+        return False
+
+    def startRegionMode(self):
+        if not self.regionMode:
+            self.regionMode = True
+            # 画布上已有的 item 都是新增的，已记在编辑日志中，保存时追加到数据库
+            self.layoutSynced = True
+            self.editsCleared = False
+
+            # scene 范围覆盖整个元件图，没加载的区域也可以滚动过去
+            bounds = self.layoutStore.bounds()
+            if bounds is not None:
+                left, top, right, bottom = bounds
+                margin = gstore.layoutRegionMargin
+                rect = QRectF(left - margin, top - margin, right - left + margin * 2, bottom - top + margin * 2)
+                self.scene.setSceneRect(self.scene.itemsBoundingRect().united(rect))
+
+            # 还没加载的设备也登记，消息照常接收、记录历史，加载后显示最新数据
+            for deviceSn in self.layoutStore.deviceSns():
+                gstore.deviceSn_to_item.setdefault(deviceSn, None)
+
+        self.loadRegion()
+
+    def regionExposed(self):
+        if self.regionMode:
+            self.regionTimer.start()
+
+    def loadRegion(self):
+        # 清空后还没保存，数据库里的 item 不再加载
+        if not self.regionMode or self.editsCleared:
+            return
+        if self.layoutLoader is not None:
+            self.regionPending = True
+            return
 
-            theClass = globals()[typeName]
-            item = theClass()
-            item.loadData(itemData)
-            self.scene.addItem(item)
+        rect = self.renderScheduler.visibleSceneRect()
+        if rect is None:
+            return
+        region = (rect.left(), rect.top(), rect.right(), rect.bottom())
+
+        # 已加载的，和删除了还没保存的，不再加载
+        exclude = {item.uid for item in self.scene.items() if getattr(item, 'uid', None)}
+        exclude.update(uid for uid, (_, kinds) in self.edits.items() if 'del' in kinds)
 
-            # 设置item可以移动
-            item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, True if self.mode == 'edit' else False)
-            # 设置item可以选中
-            item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable, True)
-            # 设置item可以聚焦，这样才会有键盘按键回调keyPressEvent
-            item.setFlag(QtWidgets.QGraphicsItem.ItemIsFocusable, True)
+        layoutDb = self.layoutStore
+        self.startLoader(LayoutLoader(
+            self, lambda: layoutDb.query(region, exclude), layoutDb.path, None))
 
+    def locateDevice(self):
+        deviceSn, ok = QtWidgets.QInputDialog.getText(self, '定位设备', '设备编号')
+        deviceSn = deviceSn.strip()
+        if not ok or not deviceSn:
+            return
+
+        item = gstore.deviceSn_to_item.get(deviceSn)
+        if item is not None:
+            self.view.centerOn(item)
+            self.scene.clearSelection()
+            item.setSelected(True)
+            return
+
+        # 还没加载的设备，按索引查到位置，滚动过去后会加载所在区域
+        itemData = self.layoutStore.findDevice(deviceSn) if self.regionMode else None
+        if itemData is None:
+            QtWidgets.QMessageBox.warning(self, '提示', f'没有找到设备 {deviceSn}')
+            return
+        self.view.centerOn(*itemData['pos'])
+        self.view.exposed()
+
+    def loadFile(self, cfgFile):
+        # 同步加载，返回时所有 item 都已创建
+        ordered, errors = parseLayout(LayoutStore(cfgFile).read())
+        for error in errors:
+            print(error)
+
+        loaded = [(index, self.addLoadedItem(itemData), bool(itemData['props'].get('设备编号')))
+                  for index, itemData in ordered]
+        loaded.sort(key=lambda x: x[0])
+        restoreStacking([(item, isDevice) for _, item, isDevice in loaded])
+
+        self.tuneSceneIndex()
+
+    def addLoadedItem(self, itemData):
+        item = ITEM_TYPES[itemData['type']]()
+        item.loadData(itemData)
+        item.uid = itemData['uid']
+        self.scene.addItem(item)
+
+        # 按区域加载的设备，加载前收到的最新消息
+        deviceSn = item.props.get('设备编号')
+        msg = self.renderScheduler.unloaded.pop(deviceSn, None) if deviceSn else None
+        if msg is not None:
+            item.handleNotify(msg)
+
+        # 设置item可以移动
+        item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, True if self.mode == 'edit' else False)
+        # 设置item可以选中
+        item.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable, True)
+        # 设置item可以聚焦，这样才会有键盘按键回调keyPressEvent
+        item.setFlag(QtWidgets.QGraphicsItem.ItemIsFocusable, True)
+        # 移动时回调 itemChange，记录到编辑日志
+        item.setFlag(QtWidgets.QGraphicsItem.ItemSendsGeometryChanges, True)
+        return item
+
+    def loadStarted(self, total):
+        self.loadProgressBar.setRange(0, max(total, 1))
+        self.loadProgressBar.setValue(0)
+        self.loadProgressBar.show()
+
+    def loadProgress(self, count):
+        self.loadProgressBar.setValue(count)
+
+    def loadFinished(self, message, synced):
+        # synced 为 None 表示加载失败，画布没有变化
+        self.layoutLoader = None
+        for action in (self.actionSave, self.actionLoad, self.actionDelItem, self.actionDelAllItem):
+            action.setEnabled(True)
+
+        if synced:
+            self.layoutSynced = True
+            for uid in self.editsBeforeLoad:
+                self.edits.pop(uid, None)
+            self.editsCleared = False
+        elif synced is False:
+            # 加载到了非空的画布上，下次保存要完整保存
+            self.layoutSynced = False
+        self.loadProgressBar.hide()
+        self.tuneSceneIndex()
+        self.statusBar().showMessage(message, 10000)
+
+        if self.regionPending:
+            self.regionPending = False
+            self.loadRegion()
+
+        # 加载失败也开始回放，只是消息找不到对应的 item
+        self.startPendingReplay()
+
+    def showTrend(self, deviceSn):
+        dialog = self.trendDialogs.get(deviceSn)
+        if dialog is None:
+            dialog = self.trendDialogs[deviceSn] = TrendDialog(deviceSn, self)
+            dialog.finished.connect(lambda: self.trendDialogs.pop(deviceSn, None))
+        dialog.show()
+        dialog.raise_()
+
+    def changeEvent(self, e):
+        super().changeEvent(e)
+        # 最小化恢复后，更新期间延后的 item
+        if e.type() == QtCore.QEvent.WindowStateChange and not self.isMinimized():
+            self.renderScheduler.markExposed()
+
+    def tuneSceneIndex(self):
+        # Qt 默认按 scene 面积决定 BSP 树深度，item 很密时每个叶子的 item 太多，
+        # 改为按 item 数计算，每个叶子大约 gstore.bspItemsPerLeaf 个
+        count = len(self.scene.items())
+        depth = math.ceil(math.log2(max(count / gstore.bspItemsPerLeaf, 1)))
+        self.scene.setBspTreeDepth(min(max(depth, 5), 16))
 
     def save(self):
+        if not self.checkNotLoading():
+            return
 
         choice = QtWidgets.QMessageBox.question(
             self,
@@ -1040,20 +2069,63 @@ class MWindow(QtWidgets.QMainWindow):
         if choice != QtWidgets.QMessageBox.Yes:
             return
 
-        itemSaveDataList = []
-        for item in self.scene.items():
-            if hasattr(item, 'toSaveData'):
-                saveData = item.toSaveData()
-                itemSaveDataList.append(saveData)
+        # 画布是从 cfg.json 加载的，只保存改动
+        if self.layoutSynced:
+            self.layoutStore.append(self.journalEntries())
+        else:
+            itemSaveDataList = []
+            for item in self.scene.items():
+                if hasattr(item, 'toSaveData'):
+                    if item.uid is None:
+                        item.uid = newUid()
+                    saveData = item.toSaveData()
+                    itemSaveDataList.append(saveData)
 
-        # print(itemSaveDataList)
+            self.layoutStore.saveFull(itemSaveDataList)
+            self.layoutSynced = True
 
+        self.edits.clear()
+        self.editsCleared = False
 
-        content = json.dumps(itemSaveDataList, indent=2, ensure_ascii=False)
-        with open('cfg.json', 'w', encoding='utf8') as f:
-            f.write(content)
+    def markEdited(self, item, kind):
+        if item.uid is None:
+            return
+        edit = self.edits.get(item.uid)
+        if edit is None:
+            edit = self.edits[item.uid] = [item, set()]
+
+        if kind == 'del':
+            # 上次保存后新增的，直接丢弃
+            if 'add' in edit[1]:
+                del self.edits[item.uid]
+            else:
+                self.edits[item.uid] = [None, {'del'}]
+        else:
+            edit[1].add(kind)
+
+    def journalEntries(self):
+        '''上次保存后的改动，转换为编辑日志的操作'''
+        entries = []
+        if self.editsCleared:
+            entries.append({'op': 'clear'})
+
+        for uid, (item, kinds) in self.edits.items():
+            if 'del' in kinds:
+                entries.append({'op': 'del', 'uid': uid})
+            elif 'add' in kinds:
+                entries.append({'op': 'add', 'item': item.toSaveData()})
+            else:
+                if 'move' in kinds:
+                    pos = item.pos()
+                    entries.append({'op': 'move', 'uid': uid, 'pos': [pos.x(), pos.y()]})
+                if 'props' in kinds:
+                    entries.append({'op': 'props', 'uid': uid, 'props': item.props})
+        return entries
 
     def delItem(self):
+        if not self.checkNotLoading():
+            return
+
         if self.mode == 'view':
             QtWidgets.QMessageBox.warning(
                 self,
@@ -1063,6 +2135,9 @@ class MWindow(QtWidgets.QMainWindow):
 
         items = self.scene.selectedItems()
         for item in items:
+            self.markEdited(item, 'del')
+            pumpAnimator.remove(item)
+            self.renderScheduler.forget(item)
             # self.scene.removeItem(item)
             shiboken6.delete(item)
 
@@ -1072,6 +2147,9 @@ class MWindow(QtWidgets.QMainWindow):
 
 
     def delAllItems(self):
+        if not self.checkNotLoading():
+            return
+
         if self.mode == 'view':
             QtWidgets.QMessageBox.warning(
                 self,
@@ -1079,6 +2157,11 @@ class MWindow(QtWidgets.QMainWindow):
                 '查看模式不能清空')
             return
         # self.scene.clear()
+        pumpAnimator.clear()
+        self.renderScheduler.deferred.clear()
+        self.renderScheduler.unloaded.clear()
+        self.edits.clear()
+        self.editsCleared = True
         for item in self.scene.items():
             if hasattr(item, 'toSaveData'):
                 shiboken6.delete(item)
@@ -1096,10 +2179,8 @@ class MWindow(QtWidgets.QMainWindow):
         row, col = 0, 0
         for picName in PIC_LIST:
 
-            # 初始参数就是图片路径名
-            pixmap = QtGui.QPixmap(f'./images/{picName}.png')
-            # 设定图片缩放大小，这里是50个像素的宽度，高度也会等比例缩放
-            pixmap = pixmap.scaledToWidth(40, Qt.SmoothTransformation)
+            # 和拖放到画布上的默认图标宽度一样，共用同一份缓存
+            pixmap = iconCache.get(picName, 40)
 
             label = DragLabel()
             label.setToolTip(picName)
@@ -1144,12 +2225,15 @@ class MWindow(QtWidgets.QMainWindow):
         leftLayout.addStretch()
 
     def setupCanvas(self):
-        self.scene = QtWidgets.QGraphicsScene(0, 0, 800, 600)
+        # 不固定 scene 大小，随 item 的范围增长，大的元件图可以缩放、滚动查看
+        self.scene = QtWidgets.QGraphicsScene()
 
         self.view = DnDGraphicView(self.scene)
         # 设定去锯齿，否则椭圆边线会有明显的锯齿
         self.view.setRenderHint(QtGui.QPainter.Antialiasing)
         self.view.setBackgroundBrush(self.brush_view)
+        # 查看模式下左键拖动空白处平移画布
+        self.view.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
 
         # 统计表
 
@@ -1166,8 +2250,8 @@ class MWindow(QtWidgets.QMainWindow):
         self.pw1.getAxis("left").label.setFont(my_font)
         self.pw1.getAxis("bottom").label.setFont(my_font)
         self.pw1.showGrid(True,True)
-        self.curve1_1 = self.pw1.plot(pen=pg.mkPen('r', width=1))
-        self.curve1_2 = self.pw1.plot(pen=pg.mkPen('#3D7D4A', width=1))
+        self.curve1_1 = self.pw1.plot(pen=pg.mkPen('r', width=1), **STATS_CURVE_OPTIONS)
+        self.curve1_2 = self.pw1.plot(pen=pg.mkPen('#3D7D4A', width=1), **STATS_CURVE_OPTIONS)
         figure1 = self.scene.addWidget(self.pw1)
         figure1.setPos(20,680)
 
@@ -1181,7 +2265,7 @@ class MWindow(QtWidgets.QMainWindow):
         self.pw2.getAxis("left").label.setFont(my_font)
         self.pw2.getAxis("bottom").label.setFont(my_font)
         self.pw2.showGrid(True,True)
-        self.curve2 = self.pw2.plot(pen=pg.mkPen('#4B7696', width=1))
+        self.curve2 = self.pw2.plot(pen=pg.mkPen('#4B7696', width=1), **STATS_CURVE_OPTIONS)
         figure2 = self.scene.addWidget(self.pw2)
         figure2.setPos(420,680)
 
@@ -1196,10 +2280,19 @@ class MWindow(QtWidgets.QMainWindow):
         self.pw3.getAxis("left").label.setFont(my_font)
         self.pw3.getAxis("bottom").label.setFont(my_font)
         self.pw3.showGrid(True,True)
-        self.curve3 = self.pw3.plot(pen=pg.mkPen('#964B4B', width=1))
+        self.curve3 = self.pw3.plot(pen=pg.mkPen('#964B4B', width=1), **STATS_CURVE_OPTIONS)
         figure3 = self.scene.addWidget(self.pw3)
         figure3.setPos(820,680)
 
+        # 统计曲线数据，保留最近 gstore.statsHistory 个点
+        self.statsSeries = SeriesStore(gstore.statsHistory)
+        self.statsCurves = {
+            'coal-1' : self.curve1_1,
+            'coal-2' : self.curve1_2,
+            'w-used' : self.curve2,
+            'e-used' : self.curve3,
+        }
+
 
 
     def setupRightPane(self):
@@ -1266,24 +2359,48 @@ class MWindow(QtWidgets.QMainWindow):
 
         selected = items[0]
         selected.itemPropChanged(cfgName,cfgValue)
+        self.markEdited(selected, 'props')
 
 
     def handle_stats(self,msg):
-        self.curve1_1.setData(msg['coal-1'])
-        self.curve1_2.setData(msg['coal-2'])
-        self.curve2.setData(msg['w-used'])
-        self.curve3.setData(msg['e-used'])
+        # 完整的 stats 替换曲线数据，stats-delta 只追加新的点
+        for name in self.statsSeries.apply(msg):
+            curve = self.statsCurves.get(name)
+            if curve is not None:
+                curve.setData(*self.statsSeries[name].data())
+
+if __name__ == '__main__':
+    # 启动通信进程，设置了回放文件时不连接网关，界面建好、元件图加载完成后回放抓包
+    if not gstore.replayFile:
+        from connector import startCommunicationThread
+        startCommunicationThread()
+
+    if gstore.capturePath:
+        connector.startCapture(gstore.capturePath)
+
+    # 设备读数写入磁盘
+    if gstore.historyStoreDir:
+        historyStore.start(gstore.historyStoreDir)
+
+    # 运行指标接口
+    if gstore.metricsPort:
+        from metrics import startMetricsServer
+        # 端口被占用(比如已经开了一个界面)时只是没有指标接口，界面照常启动
+        try:
+            startMetricsServer(gstore.metricsPort, gstore.metricsHost)
+        except OSError as e:
+            print(f"metrics server on {gstore.metricsHost}:{gstore.metricsPort} failed : {e!r}")
 
-# 启动通信进程
-from connector import startCommunicationThread
-startCommunicationThread()
 
+    app = QtWidgets.QApplication()
+    app.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.Round)
 
-app = QtWidgets.QApplication()
-app.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.Round)
+    window = MWindow()
+    window.show()
 
-window = MWindow()
-window.show()
+    if gstore.replayFile:
+        from capture import Replayer
+        window.startReplay(Replayer(connector, gstore.replayFile, gstore.replaySpeed))
 
 
-app.exec()
+    app.exec()
@@ -0,0 +1,82 @@
+"""
+运行指标 HTTP 接口
+
+各模块注册采集函数，/metrics 按 Prometheus 文本格式输出，供监控系统抓取。
+采集函数返回 [(指标名, 类型, 说明, [(标签dict, 值), ...]), ...]
+summary 等需要 _sum / _count 的，样本写为 (标签dict, 值, 名称后缀)
+"""
+
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except:
+                print(traceback.format_exc())
+                continue
+
+            for name, metricType, helpText, samples in families:
+                lines.append(f"# HELP {name} {helpText}")
+                lines.append(f"# TYPE {name} {metricType}")
+                for labels, value, *suffix in samples:
+                    if value is None:
+                        continue
+                    sampleName = name + suffix[0] if suffix else name
+                    lines.append(f"{sampleName}{formatLabels(labels)} {float(value)!r}")
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+def escapeLabelValue(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{escapeLabelValue(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不打印每次抓取的访问日志
+        pass
+
+
+def startMetricsServer(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"metrics on http://{host}:{port}/metrics")
+    return server
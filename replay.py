@@ -0,0 +1,105 @@
+"""
+抓包和回放命令行工具
+
+    python replay.py record incident.bscap --seconds 600    # 连接网关，抓包10分钟
+    python replay.py play incident.bscap                    # 按原来的时间间隔回放
+    python replay.py play incident.bscap --speed 10         # 10倍速回放
+    python replay.py play incident.bscap --speed 0 --loops 5   # 尽快回放，测量最大处理速率
+
+回放不启动界面，抓包文件中出现的所有设备都当作界面上存在的设备，
+消息完整经过 connector.handleFrame 的解码和分发。
+界面中回放抓包文件，设置 share.py 中的 gstore.replayFile 后启动 main.py
+"""
+
+import argparse
+import time
+
+from capture import Replayer, readCapture
+from coalescer import coalescer
+from connector import connector, peekDeviceSn, startCommunicationThread
+from share import gstore
+import binproto
+
+
+def record(args):
+    connector.startCapture(args.file)
+    startCommunicationThread()
+    try:
+        deadline = time.monotonic() + args.seconds if args.seconds else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            capture = connector.capture
+            print(f"captured {capture.frames} frames, {capture.bytes / 1024 / 1024:.1f}MB")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connector.stopCapture()
+
+
+def registerDevices(path):
+    """抓包中出现的设备都注册到 deviceSn_to_item，回放时不会因为未知设备被跳过"""
+    for _, frame in readCapture(path):
+        try:
+            version, msgType, _, _, deviceSn, msgBodyBytes = connector.msg_split(frame)
+        except Exception:
+            continue
+        if msgType != "notify-to-frontend":
+            continue
+        if deviceSn is None:
+            if version == binproto.VERSION:
+                deviceSn = binproto.peekDeviceSn(msgBodyBytes)
+            else:
+                deviceSn = peekDeviceSn(msgBodyBytes)
+        if deviceSn:
+            gstore.deviceSn_to_item[deviceSn] = None
+
+
+def play(args):
+    registerDevices(args.file)
+    print(f"{len(gstore.deviceSn_to_item)} devices in capture")
+
+    replayer = Replayer(connector, args.file, args.speed, args.loops)
+    thread = replayer.start()
+
+    lastFrames = 0
+    while thread.is_alive():
+        thread.join(1)
+        # 没有界面取走合并后的通知，这里代替界面清空
+        coalescer.drain()
+        s = replayer.snapshot()
+        print(
+            f"replayed {s['frames']} frames ({s['frames'] - lastFrames:,}/s)"
+            f" | decoded {connector.framesDecoded} | failures {connector.decodeFailures}"
+            f" | lag {s['lag']:.2f}s"
+        )
+        lastFrames = s["frames"]
+
+    s = replayer.snapshot()
+    print(
+        f"done: {s['frames']} frames, {s['bytes'] / 1024 / 1024:.1f}MB in {s['seconds']:.2f}s"
+        f" | {s['framesPerSec']:,.0f} frames/s"
+        f" | {s['bytes'] / 1024 / 1024 / s['seconds'] if s['seconds'] else 0:.1f}MB/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网关消息抓包和回放")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="连接网关并抓包")
+    p.add_argument("file")
+    p.add_argument("--seconds", type=float, default=0, help="抓包秒数，0 一直抓到 Ctrl+C")
+    p.set_defaults(func=record)
+
+    p = sub.add_parser("play", help="回放抓包文件")
+    p.add_argument("file")
+    p.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 尽快回放")
+    p.add_argument("--loops", type=int, default=1, help="重复回放的次数")
+    p.set_defaults(func=play)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class RingSeries:
+    """
+    固定长度的曲线数据，NumPy 环形缓冲区
+
+    每个点同时写在 i 和 i + capacity 两个位置，
+    最近 count 个点总是 buf 里连续的一段，取数据不用拷贝拼接
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.x = np.zeros(capacity * 2)
+        self.y = np.zeros(capacity * 2)
+        self.pos = 0  # 下一个点写入的位置
+        self.count = 0  # 已有的点数，最多 capacity
+        self.total = 0  # 累计收到的点数，作为横坐标
+
+    def clear(self):
+        self.pos = self.count = self.total = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if n == 0:
+            return
+
+        cap = self.capacity
+        xs = np.arange(self.total, self.total + n, dtype=float)
+        self.total += n
+
+        # 超过容量的部分直接丢掉
+        if n >= cap:
+            values, xs = values[-cap:], xs[-cap:]
+            self.x[:cap] = self.x[cap:] = xs
+            self.y[:cap] = self.y[cap:] = values
+            self.pos = 0
+            self.count = cap
+            return
+
+        index = (self.pos + np.arange(n)) % cap
+        self.x[index] = self.x[index + cap] = xs
+        self.y[index] = self.y[index + cap] = values
+        self.pos = (self.pos + n) % cap
+        self.count = min(self.count + n, cap)
+
+    def replace(self, values):
+        self.clear()
+        self.extend(values)
+
+    def data(self):
+        """返回 (x, y)，按时间顺序，是缓冲区的视图，下次写入前有效"""
+        end = self.pos + self.capacity
+        start = end - self.count
+        return self.x[start:end], self.y[start:end]
+
+
+class SeriesStore:
+    """
+    stats 统计曲线数据
+
+    完整的 stats 消息替换曲线的全部数据，
+    stats-delta 增量消息(合并后带 delta 标记)只追加新的点
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.series = {}
+
+    def __getitem__(self, name):
+        return self.series[name]
+
+    def apply(self, msg):
+        """更新曲线数据，返回有变化的曲线名"""
+        delta = msg.get("delta", False)
+        changed = []
+        for name, values in msg.items():
+            if not isinstance(values, list):
+                continue
+
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = RingSeries(self.capacity)
+
+            if delta:
+                series.extend(values)
+            else:
+                series.replace(values)
+            changed.append(name)
+        return changed
@@ -1,4 +1,50 @@
 class gstore:
     deviceSn_to_item = {}
     rtmpPlayer = r'"c:\Program Files (x86)\VideoLAN\VLC\vlc.exe"'
-    main_window = None
\ No newline at end of file
+    main_window = None
+    # 界面线程处理设备通知的间隔，单位毫秒
+    notifyDrainInterval = 50
+    # 控制命令 p95 往返延迟超过这个值(秒)时，状态栏标红
+    controlLatencyWarn = 1.0
+    # 运行指标 http 接口端口，0 表示不开启。需要远程抓取时 metricsHost 改为 '0.0.0.0'
+    metricsPort = 9477
+    metricsHost = '127.0.0.1'
+    # 风泵动画的最高帧率
+    pumpAnimationFps = 30
+    # 缩放后的设备图标最多缓存的个数
+    iconCacheSize = 256
+    # 画布缩放比例范围
+    zoomMin = 0.02
+    zoomMax = 8.0
+    # 缩放比例低于这个值时，设备画成简单的色块，不画文字和细节
+    lodScale = 0.4
+    # scene BSP 索引每个叶子大约的 item 数
+    bspItemsPerLeaf = 16
+    # 统计曲线保留的点数
+    statsHistory = 3600
+    # 每个设备在内存中保留的读数条数，和所有设备读数历史的内存上限(MB)
+    historyPoints = 1200
+    historyBudgetMB = 256
+    # 设备读数磁盘存储目录，空字符串表示不保存
+    historyStoreDir = 'history'
+    # 收到的原始消息抓包保存的文件，空字符串表示不抓包
+    capturePath = ''
+    # 回放的抓包文件，设置后不连接网关。replaySpeed 为回放倍速，0 表示尽快回放
+    replayFile = ''
+    replaySpeed = 1.0
+    # 分步加载元件图时，界面线程每批创建 item 最多用的毫秒数
+    loadSliceMs = 30
+    # 完整保存元件图时不缩进，文件更小、写入更快
+    layoutCompact = False
+    # 编辑日志超过这么多条时，后台合并进 cfg.json
+    journalCompactEntries = 2000
+    # 元件图使用的 SQLite 文件，设置后按可见区域加载，见 layoutdb.py
+    layoutDbFile = ''
+    # 按区域加载时，查询范围比可见区域向外扩大的距离
+    layoutRegionMargin = 500
+    # 滚动、缩放停下多少毫秒后加载新露出来的区域
+    regionLoadDelay = 200
+    # 读数磁盘存储同时打开的列文件数上限，每个分区每列一个文件
+    historyMaxOpenFiles = 256
+    # 读数磁盘存储保留的天数，0 一直保留
+    historyRetentionDays = 90
\ No newline at end of file
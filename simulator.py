@@ -0,0 +1,269 @@
+"""
+本地网关模拟器
+
+代替 127.0.0.1:47554 上的网关服务，按 BF01/BF02 协议给连接上来的客户端推送
+notify-to-frontend 设备消息和 stats 统计数据，并确认收到的 device_control 命令。
+
+    python simulator.py                          # cfg.json 里的设备，每秒100条
+    python simulator.py --gas 2000 --rate 20000  # 另加2000个燃气表，每秒2万条
+    python simulator.py --binary --sn-header     # 支持 BF02，消息头带设备编号
+    python simulator.py --stats-delta            # stats 首次完整推送，之后只推送新增的点
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import traceback
+
+from aioconnector import readFrame
+from connector import CONTROL_ACK_TYPE, STATS_DELTA_TYPE, Connector
+
+# 设备种类 : (cfg.json 中对应的 item 类型, 生成读数的函数)
+DEVICE_KINDS = {
+    "gas": (
+        ("PictureItem_GasMeter",),
+        lambda t, p: {
+            "CO": round(0.05 + 0.03 * math.sin(t + p), 3),
+            "SO2": round(0.01 + 0.005 * random.random(), 3),
+            "HCl": round(0.01 + 0.005 * random.random(), 3),
+        },
+    ),
+    "temp": (
+        ("PictureItem_TempMeter",),
+        lambda t, p: {
+            "temperature": round(25 + 5 * math.sin(t / 10 + p), 1),
+            "humidity": round(60 + 10 * math.sin(t / 7 + p), 1),
+        },
+    ),
+    "wind": (
+        ("PictureItem_WindMeter",),
+        lambda t, p: {"flow-rate": round(3 + 2 * math.sin(t / 3 + p), 2)},
+    ),
+    "water": (
+        ("PictureItem_WaterMeter",),
+        lambda t, p: {
+            "flow-rate": round(1.5 + math.sin(t / 4 + p), 2),
+            "water-pressure": round(0.3 + 0.1 * math.sin(t / 5 + p), 3),
+        },
+    ),
+    "tank": (
+        ("WaterTankItem", "PictureItem_WaterTank"),
+        lambda t, p: {"water-amount": round(0.5 + 0.45 * math.sin(t / 20 + p), 3)},
+    ),
+    "pump": (
+        ("WindPumpItem",),
+        lambda t, p: {"fan-speed": int(t / 10 + p) % 4},
+    ),
+}
+
+
+def loadDevices(cfgFile, extraCounts):
+    """返回 [(device-sn, 种类)]，包括 cfg.json 里的设备和额外生成的设备"""
+    devices = []
+
+    if cfgFile:
+        type_to_kind = {}
+        for kind, (typeNames, _) in DEVICE_KINDS.items():
+            for typeName in typeNames:
+                type_to_kind[typeName] = kind
+
+        with open(cfgFile, "r", encoding="utf8") as f:
+            for itemData in json.load(f):
+                kind = type_to_kind.get(itemData["type"])
+                deviceSn = itemData.get("props", {}).get("设备编号")
+                if kind and deviceSn:
+                    devices.append((deviceSn, kind))
+
+    for kind, count in extraCounts.items():
+        for i in range(count):
+            devices.append((f"sim-{kind}-{i:05d}", kind))
+
+    return devices
+
+
+class Simulator:
+    def __init__(self, args):
+        self.args = args
+        self.devices = loadDevices(args.cfg, {k: getattr(args, k) for k in DEVICE_KINDS})
+        # 每个设备一个相位，读数曲线错开
+        self.phases = [random.random() * 10 for _ in self.devices]
+        self.codec = Connector()
+        self.stats = {
+            name: [random.uniform(50, 100)] for name in ("coal-1", "coal-2", "w-used", "e-used")
+        }
+
+        self.clients = set()
+        self.sent = 0
+        self.controls = 0
+
+    def makeStats(self):
+        # 统计数据做随机游走，保持 stats-len 个点
+        for values in self.stats.values():
+            values.append(max(0, values[-1] + random.uniform(-5, 5)))
+            del values[: -self.args.stats_len]
+            while len(values) < self.args.stats_len:
+                values.insert(0, values[0])
+
+        msgBody = {"device-sn": "stats"}
+        msgBody.update(self.stats)
+        return msgBody
+
+    def makeStatsDelta(self):
+        self.makeStats()
+        msgBody = {"device-sn": "stats"}
+        for name, values in self.stats.items():
+            msgBody[name] = values[-1:]
+        return msgBody
+
+    def encode(self, client, msgBody, msgType="notify-to-frontend", msgCode=None):
+        headerSn = msgBody.get("device-sn") if self.args.sn_header else None
+        return self.codec.encodeMsg(
+            msgType, msgBody, client["version"], msgCode, headerSn=headerSn
+        )
+
+    async def handleClient(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        print(f"client {peer} connected")
+        client = {"writer": writer, "version": "BF01"}
+        self.clients.add(id(client))
+
+        sender = asyncio.create_task(self.sendLoop(client))
+        try:
+            while True:
+                frame = await readFrame(reader)
+                await self.handleClientMsg(client, frame[:-1])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            sender.cancel()
+            self.clients.discard(id(client))
+            writer.close()
+            print(f"client {peer} disconnected")
+
+    async def handleClientMsg(self, client, msgBytes):
+        version, msgType, isResend, msgCode, _, msgBodyBytes = self.codec.msg_split(
+            msgBytes
+        )
+        msgBody = self.codec.body_decode(version, msgBodyBytes)
+
+        if msgType == "negotiate":
+            # 不开 --binary 时模拟老网关，不回复
+            if self.args.binary and "BF02" in msgBody.get("versions", []):
+                reply = self.encode(client, {"version": "BF02"}, "negotiate")
+                client["writer"].write(reply)
+                client["version"] = "BF02"
+
+        elif msgType == "device_control":
+            self.controls += 1
+            if self.args.verbose:
+                print(f"device_control {msgCode} resend={isResend} {msgBody}")
+            if random.random() >= self.args.ack_loss:
+                reply = self.encode(client, {}, CONTROL_ACK_TYPE, msgCode)
+                asyncio.get_running_loop().call_later(
+                    self.args.ack_delay, client["writer"].write, reply
+                )
+
+    async def sendLoop(self, client):
+        args = self.args
+        writer = client["writer"]
+        interval = 0.01
+        credit = 0.0
+        index = 0
+        started = lastTick = nextStats = time.monotonic()
+        # 每个客户端第一次推送完整的 stats
+        statsSent = False
+
+        while True:
+            now = time.monotonic()
+            chunks = []
+
+            if args.stats_interval > 0 and now >= nextStats:
+                if args.stats_delta and statsSent:
+                    chunks.append(self.encode(client, self.makeStatsDelta(), STATS_DELTA_TYPE))
+                else:
+                    chunks.append(self.encode(client, self.makeStats()))
+                statsSent = True
+                nextStats = now + args.stats_interval
+
+            if self.devices:
+                # 按实际经过的时间累计可发送的消息数，sleep 不准时也能保持速率
+                credit += args.rate * (now - lastTick)
+                t = now - started
+                while credit >= 1:
+                    credit -= 1
+                    deviceSn, kind = self.devices[index]
+                    msgBody = {"device-sn": deviceSn}
+                    msgBody.update(DEVICE_KINDS[kind][1](t, self.phases[index]))
+                    if args.timestamp:
+                        msgBody["ts"] = time.time()
+                    chunks.append(self.encode(client, msgBody))
+                    index = (index + 1) % len(self.devices)
+
+            lastTick = now
+
+            if chunks:
+                writer.write(b"".join(chunks))
+                self.sent += len(chunks)
+                await writer.drain()
+
+            await asyncio.sleep(max(0, interval - (time.monotonic() - now)))
+
+    async def report(self):
+        lastSent, lastTime = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(5)
+            now = time.monotonic()
+            rate = (self.sent - lastSent) / (now - lastTime)
+            lastSent, lastTime = self.sent, now
+            print(
+                f"clients {len(self.clients)} | sent {self.sent} ({rate:,.0f}/s)"
+                f" | device_control {self.controls}"
+            )
+
+    async def main(self):
+        server = await asyncio.start_server(self.handleClient, self.args.host, self.args.port)
+        kinds = {}
+        for _, kind in self.devices:
+            kinds[kind] = kinds.get(kind, 0) + 1
+        print(f"simulator listening on {self.args.host}:{self.args.port}, devices {kinds}")
+
+        async with server:
+            reporter = asyncio.create_task(self.report())
+            if self.args.duration:
+                await asyncio.sleep(self.args.duration)
+            else:
+                await server.serve_forever()
+            reporter.cancel()
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="本地网关模拟器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=47554)
+    parser.add_argument("--cfg", default="cfg.json", help="读取其中的设备编号，空字符串表示不读取")
+    for kind in DEVICE_KINDS:
+        parser.add_argument(f"--{kind}", type=int, default=0, help=f"额外生成的 {kind} 设备数")
+    parser.add_argument("--rate", type=float, default=100, help="每秒推送的设备消息总数")
+    parser.add_argument("--stats-len", type=int, default=100, help="stats 每个数组的长度")
+    parser.add_argument("--stats-interval", type=float, default=1.0, help="stats 推送间隔秒数，0 不推送")
+    parser.add_argument("--stats-delta", action="store_true", help="stats 首次之后只推送新增的点")
+    parser.add_argument("--binary", action="store_true", help="客户端请求时使用 BF02 二进制消息体")
+    parser.add_argument("--sn-header", action="store_true", help="消息头带设备编号字段")
+    parser.add_argument("--timestamp", action="store_true", help="设备消息带发送时间 ts 字段，用于统计延迟")
+    parser.add_argument("--ack-delay", type=float, default=0, help="确认控制命令前等待的秒数")
+    parser.add_argument("--ack-loss", type=float, default=0, help="不确认控制命令的比例")
+    parser.add_argument("--duration", type=float, default=0, help="运行秒数，0 一直运行")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(Simulator(parseArgs()).main())
+    except KeyboardInterrupt:
+        pass
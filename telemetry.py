@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from share import gstore
+
+# 记录历史的读数字段
+FIELDS = (
+    "CO",
+    "SO2",
+    "HCl",
+    "temperature",
+    "humidity",
+    "flow-rate",
+    "water-pressure",
+    "water-amount",
+)
+
+NAN = float("nan")
+
+
+class DeviceHistory:
+    """一个设备最近 capacity 条消息的读数，每个字段一个 NumPy 环形数组"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        # 字段名 : 读数数组，收到该字段时才分配
+        self.values = {}
+        self.pos = 0
+        self.count = 0
+
+    def nbytes(self):
+        return self.t.nbytes + sum(v.nbytes for v in self.values.values())
+
+    def append(self, ts, msgBody):
+        """写入一条消息，返回新分配的字节数"""
+        pos = self.pos
+        self.t[pos] = ts
+        allocated = 0
+
+        values = self.values
+        for name in FIELDS:
+            value = msgBody.get(name)
+            arr = values.get(name)
+            if arr is None:
+                if value is None:
+                    continue
+                arr = values[name] = np.full(self.capacity, NAN, dtype=np.float32)
+                allocated += arr.nbytes
+
+            try:
+                arr[pos] = NAN if value is None else value
+            except (TypeError, ValueError):
+                arr[pos] = NAN
+
+        self.pos = (pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        return allocated
+
+    def ordered(self, arr):
+        if self.count < self.capacity:
+            return arr[: self.count].copy()
+        return np.concatenate((arr[self.pos :], arr[: self.pos]))
+
+
+class TelemetryHistory:
+    """
+    设备读数历史
+
+    接收线程在合并通知之前记录每条消息，界面线程查询画趋势图。
+    所有设备的数组总大小不超过 budgetBytes，超出时先淘汰从没查看过的设备
+    (先记录的先淘汰)，再淘汰最久没查看的设备
+    """
+
+    def __init__(self, capacity, budgetBytes):
+        self.capacity = capacity
+        self.budgetBytes = budgetBytes
+        self.lock = threading.Lock()
+
+        self.devices = {}
+        # 淘汰顺序，前面的先淘汰
+        self.unviewed = OrderedDict()
+        self.viewed = OrderedDict()
+
+        # 统计
+        self.bytesUsed = 0
+        self.recorded = 0
+        self.evictions = 0
+
+    def record(self, deviceSn, msgBody):
+        ts = msgBody.get("ts") or time.time()
+        with self.lock:
+            history = self.devices.get(deviceSn)
+            created = history is None
+            if created:
+                # 没有读数字段的设备(比如风泵)不记录
+                if not any(name in msgBody for name in FIELDS):
+                    return
+                history = self.devices[deviceSn] = DeviceHistory(self.capacity)
+                self.unviewed[deviceSn] = None
+                self.bytesUsed += history.nbytes()
+
+            allocated = history.append(ts, msgBody)
+            self.recorded += 1
+            if created or allocated:
+                self.bytesUsed += allocated
+                self.evict(keep=deviceSn)
+
+    def evict(self, keep):
+        for order in (self.unviewed, self.viewed):
+            while self.bytesUsed > self.budgetBytes and order:
+                deviceSn = next(iter(order))
+                if deviceSn == keep:
+                    # 正在写入的设备不淘汰
+                    if len(order) == 1:
+                        break
+                    order.move_to_end(deviceSn)
+                    continue
+
+                del order[deviceSn]
+                self.bytesUsed -= self.devices.pop(deviceSn).nbytes()
+                self.evictions += 1
+
+    def query(self, deviceSn):
+        """返回 (时间数组, {字段名 : 读数数组})，按时间顺序，没有记录返回 None"""
+        with self.lock:
+            history = self.devices.get(deviceSn)
+            if history is None or history.count == 0:
+                return None
+
+            # 查看过的设备最后淘汰
+            self.unviewed.pop(deviceSn, None)
+            self.viewed[deviceSn] = None
+            self.viewed.move_to_end(deviceSn)
+
+            t = history.ordered(history.t)
+            fields = {name: history.ordered(arr) for name, arr in history.values.items()}
+        return t, fields
+
+    def snapshot(self):
+        return {
+            "devices": len(self.devices),
+            "bytesUsed": self.bytesUsed,
+            "recorded": self.recorded,
+            "evictions": self.evictions,
+        }
+
+
+telemetry = TelemetryHistory(gstore.historyPoints, gstore.historyBudgetMB * 1024 * 1024)
+
+
+@metrics.registry.register
+def collectMetrics():
+    s = telemetry.snapshot()
+    return [
+        ("bs_history_devices", "gauge", "内存中有读数历史的设备数", [({}, s["devices"])]),
+        ("bs_history_bytes", "gauge", "读数历史占用的字节数", [({}, s["bytesUsed"])]),
+        ("bs_history_recorded_total", "counter", "记录的设备消息数", [({}, s["recorded"])]),
+        ("bs_history_evictions_total", "counter", "因内存上限淘汰的设备数", [({}, s["evictions"])]),
+    ]